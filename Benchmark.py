@@ -0,0 +1,414 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import Route_Generation
+from Demand_Simulation import demand_costs, simulate_demands
+from traveldurationsim import mu, sigma, travel_costs
+from Woolworths_LP import SolverConfig, maxTrucks, solve_route_model
+
+# Files the results are written to and compared against
+resultsFile = "benchmark_results.json"
+baselineFile = "benchmark_baseline.json"
+
+# Ratio of a stage's time or peak memory to the baseline above which it is a regression
+regressionTolerance = 1.25
+
+# Number of times larger than Auckland the synthetic instances are
+scales = [10]
+
+# Time limit given to the solver on each day's model. CBC only checks it at some points
+# and can run well past it (e.g. while presolving), so it does not bound the LP stages
+lpTimeLimit = 60
+
+simulations = 1000
+seed = 100
+
+
+def auckland_instance():
+    """Loads the shipped Auckland data as a benchmark instance
+
+    Returns:
+    --------
+    instance : Dict
+        durations (DurationMatrix), coordinates, demand and dailyDemand (Panda
+        dataframes of the demand by weekday and by date), storeLocations and maxTrucks
+    """
+    durations, coordinates, demand = Route_Generation.load_data()
+
+    return {
+        "durations": durations,
+        "coordinates": coordinates,
+        "demand": demand,
+        "dailyDemand": pd.read_csv("Formatted Demands.csv"),
+        "storeLocations": pd.read_csv("WoolworthsDemands.csv", usecols=[0]),
+        "maxTrucks": maxTrucks,
+    }
+
+
+def synthetic_instance(scale, seed=seed):
+    """Builds an instance with scale times as many stores as Auckland
+
+    Each Auckland store is copied scale times at random points a few kilometres
+    from it, with the same demand. Travel times are a straight line fit of the
+    Auckland travel times against the distance between stores.
+
+    Parameters:
+    -----------
+    scale : int
+        Number of copies of each store
+    seed : int
+        Seed of the random store positions
+
+    Returns:
+    --------
+    instance : Dict
+        Instance in the same form as auckland_instance
+    """
+    rng = np.random.default_rng(seed)
+    base = auckland_instance()
+    durations, coordinates = base["durations"], base["coordinates"]
+
+    # fits the travel time between stores to the distance between them
+    position = coordinates.set_index("Store").loc[durations.stores, ["Lat", "Long"]]
+    distance = _distances(position.to_numpy())
+    offDiagonal = ~np.eye(len(distance), dtype=bool)
+    slope, intercept = np.polyfit(
+        distance[offDiagonal], durations.values[offDiagonal], 1
+    )
+
+    # copies every store scale times, about 2km from the original
+    stores = coordinates[coordinates["Type"] != "Distribution Centre"]
+    depot = coordinates[coordinates["Type"] == "Distribution Centre"]
+    copies = stores.loc[stores.index.repeat(scale)].reset_index(drop=True)
+    copy = np.tile(np.arange(scale), len(stores))
+    copies["Store"] = copies["Store"] + " " + copy.astype(str)
+    copies[["Lat", "Long"]] += rng.normal(0, 0.02, (len(copies), 2))
+    newCoordinates = pd.concat([copies, depot], ignore_index=True)
+
+    names = newCoordinates["Store"].tolist()
+    values = _distances(newCoordinates[["Lat", "Long"]].to_numpy())
+    values *= slope
+    values += intercept
+    np.fill_diagonal(values, 0)
+    newDurations = Route_Generation.DurationMatrix(values, names, len(names) - 1)
+
+    # each copy has the demand of the store it was copied from
+    originals = np.repeat(stores["Store"].to_numpy(), scale)
+    demand = base["demand"].set_index("Store").reindex(originals).fillna(0)
+    demand = demand.reset_index(drop=True).assign(Store=copies["Store"])
+    dailyDemand = base["dailyDemand"].set_index("Store").reindex(originals).fillna(0)
+    dailyDemand = dailyDemand.reset_index(drop=True)
+    dailyDemand.insert(0, "Store", copies["Store"])
+
+    return {
+        "durations": newDurations,
+        "coordinates": newCoordinates,
+        "demand": demand,
+        "dailyDemand": dailyDemand,
+        "storeLocations": pd.DataFrame({"Store": np.sort(copies["Store"].to_numpy())}),
+        "maxTrucks": maxTrucks * scale,
+    }
+
+
+def _distances(position):
+    """Returns the matrix of kilometres between every pair of (Lat, Long) positions"""
+    lat = np.radians(position[:, 0])
+    long = np.radians(position[:, 1])
+    x = (long[None, :] - long[:, None]) * np.cos(lat.mean())
+    y = lat[None, :] - lat[:, None]
+
+    return 6371 * np.hypot(x, y)
+
+
+@contextlib.contextmanager
+def _temporary_directory():
+    """Runs the block in a temporary working directory, so solver files such as
+    Routes.lp do not overwrite the ones in the repository"""
+    start = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield
+        finally:
+            os.chdir(start)
+
+
+def measure(function, memory=True):
+    """Times one call of function, measuring its peak memory during the call
+
+    Tracing allocations slows python code down, so times measured with and without
+    memory should not be compared. Memory used by solver processes is not included.
+
+    Parameters:
+    -----------
+    function : function
+        Function taking no arguments
+    memory : Boolean
+        Boolean equalling true to measure the peak memory
+
+    Returns:
+    --------
+    result : object
+        Value returned by the timed call
+    seconds : float
+        Wall time of the timed call
+    peakMemory : int
+        Most bytes allocated at once during the call, None if not measured
+    """
+    if memory:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        peakMemory = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+
+    return result, seconds, peakMemory
+
+
+def run_benchmarks(
+    instance, simulations=simulations, workers=1, memory=True, timeLimit=lpTimeLimit
+):
+    """Runs and measures every stage of the pipeline on an instance
+
+    Parameters:
+    -----------
+    instance : Dict
+        Instance from auckland_instance or synthetic_instance
+    simulations : int
+        Number of simulations in the simulation stages
+    workers : int
+        Number of processes to generate routes with (memory is only measured in
+        this process, so 1 gives the full peak)
+    memory : Boolean
+        Boolean equalling true to measure the peak memory of each stage
+    timeLimit : float
+        Time limit given to the solver on each day's model (it does not bound the
+        stage's time), the status of the solution is recorded so runs stopped by
+        the limit can be told apart
+
+    Returns:
+    --------
+    results : Dict
+        For each stage, its seconds, peakMemory and (where there is one) the
+        number of routes it worked on. If a day's model has no solution its
+        simulation stages are not run, and are recorded with skipped giving the
+        reason and no seconds or peakMemory
+    """
+    results = {}
+
+    def record(stage, function, routes=None):
+        result, seconds, peakMemory = measure(function, memory)
+        results[stage] = {"seconds": seconds, "peakMemory": peakMemory}
+        if routes is not None:
+            results[stage]["routes"] = routes(result)
+        print(f"  {stage}: {seconds:.3f}s", flush=True)
+        return result
+
+    days = record(
+        "route_generation",
+        lambda: Route_Generation.generate_all_routes(
+            workers,
+            durations=instance["durations"],
+            coordinates=instance["coordinates"],
+            demand=instance["demand"],
+        ),
+        lambda days: len(days[0]) + len(days[1]),
+    )
+
+    storeLocations = instance["storeLocations"]
+    storeDemand = (
+        instance["demand"]
+        .set_index("Store")
+        .reindex(storeLocations["Store"])[Route_Generation.dayDemandColumns]
+        .fillna(0)
+        .to_numpy()
+    )
+    for isSaturday, day in enumerate(("weekday", "saturday")):
+        routes = days[isSaturday]
+        coverRows = np.flatnonzero(storeDemand[:, isSaturday] != 0)
+
+        def solve():
+            with _temporary_directory():
+                return solve_route_model(
+                    routes,
+                    storeLocations,
+                    bool(isSaturday),
+                    coverRows=coverRows,
+                    maxTrucks=instance["maxTrucks"],
+                    solver=SolverConfig(timeLimit=timeLimit),
+                )
+
+        solution = record("lp_" + day, solve, lambda solution: len(routes))
+        results["lp_" + day]["status"] = solution.status
+        results["lp_" + day]["solver"] = solution.stats
+
+        # without a plan there is nothing valid to simulate
+        if not solution.selected.any():
+            for stage in ("demand_simulation_", "travel_simulation_"):
+                results[stage + day] = {
+                    "seconds": None,
+                    "peakMemory": None,
+                    "skipped": "no solution: "
+                    + solution.stats["solutionStatus"].lower(),
+                }
+                print(f"  {stage + day}: skipped", flush=True)
+            continue
+        plan = solution.routes
+
+        record(
+            "demand_simulation_" + day,
+            lambda: demand_costs(
+                simulate_demands(
+                    plan,
+                    instance["dailyDemand"],
+                    bool(isSaturday),
+                    simulations,
+                    np.random.default_rng(seed),
+                )
+            ),
+            lambda costs: len(plan),
+        )
+
+        travel, unload = Route_Generation.travel_and_unload(plan)
+        record(
+            "travel_simulation_" + day,
+            lambda: travel_costs(
+                travel,
+                unload,
+                np.random.default_rng(seed).lognormal(mu, sigma, simulations),
+            ),
+            lambda costs: len(plan),
+        )
+
+    return results
+
+
+def compare(results, baseline, tolerance=regressionTolerance):
+    """Finds the stages that are slower or use more memory than in the baseline
+
+    Parameters:
+    -----------
+    results : Dict
+        Results of each instance, as in the results file
+    baseline : Dict
+        Earlier results in the same form
+    tolerance : float
+        Ratio to the baseline above which a measurement is a regression
+
+    Returns:
+    --------
+    regressions : List
+        Description of each regression
+    """
+    regressions = []
+    for name, stages in results["instances"].items():
+        for stage, measurements in stages.items():
+            before = baseline["instances"].get(name, {}).get(stage)
+            if before is None:
+                continue
+            for measurement in ("seconds", "peakMemory"):
+                new, old = measurements.get(measurement), before.get(measurement)
+                if new is not None and old and new > tolerance * old:
+                    regressions.append(
+                        f"{name} {stage} {measurement}: {new:.4g} vs baseline "
+                        f"{old:.4g} ({new / old:.2f}x)"
+                    )
+
+    return regressions
+
+
+def print_table(results):
+    """Prints the time, peak memory and routes of every stage"""
+    print(f"{'instance':<12}{'stage':<28}{'seconds':>10}{'peak MB':>10}{'routes':>10}")
+    for name, stages in results["instances"].items():
+        for stage, measurements in stages.items():
+            seconds = measurements["seconds"]
+            seconds = "skipped" if seconds is None else f"{seconds:.3f}"
+            peakMemory = measurements["peakMemory"]
+            peakMemory = "" if peakMemory is None else f"{peakMemory / 2**20:.1f}"
+            print(
+                f"{name:<12}{stage:<28}{seconds:>10}"
+                f"{peakMemory:>10}{measurements.get('routes', ''):>10}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks route generation, the LP and the simulations"
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="*",
+        default=scales,
+        help="sizes of the synthetic instances as multiples of Auckland, e.g. 10 100",
+    )
+    parser.add_argument("--simulations", type=int, default=simulations)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--lp-time-limit",
+        type=float,
+        default=lpTimeLimit,
+        help="time limit given to the solver, CBC can run past it",
+    )
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output", default=resultsFile)
+    parser.add_argument("--baseline", default=baselineFile)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="also save the results as the baseline",
+    )
+    arguments = parser.parse_args()
+
+    instances = {"auckland": auckland_instance}
+    for scale in arguments.scales:
+        instances[f"x{scale}"] = lambda scale=scale: synthetic_instance(scale)
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "simulations": arguments.simulations,
+        "lpTimeLimit": arguments.lp_time_limit,
+        "instances": {},
+    }
+    for name, instance in instances.items():
+        print(name, flush=True)
+        results["instances"][name] = run_benchmarks(
+            instance(),
+            arguments.simulations,
+            arguments.workers,
+            not arguments.no_memory,
+            arguments.lp_time_limit,
+        )
+
+    with open(arguments.output, "w") as file:
+        json.dump(results, file, indent=2)
+    if arguments.save_baseline:
+        with open(arguments.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+
+    print_table(results)
+
+    if os.path.exists(arguments.baseline) and not arguments.save_baseline:
+        with open(arguments.baseline) as file:
+            regressions = compare(results, json.load(file))
+        for regression in regressions:
+            print("Regression:", regression)
+        if regressions:
+            sys.exit(1)
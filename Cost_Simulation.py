@@ -0,0 +1,486 @@
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.stats as st
+
+from Demand_Simulation import demand_costs, simulate_demands
+from Demand_Simulation import load_data as load_simulation_data
+from Route_Generation import (
+    RoutePool,
+    group_coordinates,
+    locationFile,
+    stopColumns,
+    travel_and_unload,
+    unloadTime,
+)
+from Simulation_Stats import CostAccumulator, default_bins
+from Woolworths_LP import duration_costs, solve_lp, solve_route_model, solve_scenario
+
+simulations = 1000
+seed = 100
+
+# estimated lognormal distribution of the travel time factor
+mu = 0.03
+sigma = 0.07
+
+
+def route_sectors(routes, coordinates):
+    """Finds which sector (from group_coordinates) each route is in, using its first stop
+
+    Parameters:
+    -----------
+    routes : Panda dataframe or RoutePool
+        Dataframe of routes containing trip duration and stops
+    coordinates : Panda dataframe
+        Dataframe containing coordinates of each store's locations
+
+    Returns:
+    --------
+    sectors : 1d Array
+        Sector number of each route (0 south, 1 east, 2 west), -1 if the first
+        stop is in none of them
+    """
+    sectorOf = {}
+    for sector, locations in enumerate(group_coordinates(coordinates)):
+        for location in locations:
+            sectorOf[location] = sector
+
+    if isinstance(routes, RoutePool):
+        firstStops = pd.Series(routes.stop_names()[:, 0])
+    else:
+        firstStops = routes["First Stop"]
+
+    return firstStops.map(sectorOf).fillna(-1).to_numpy(dtype=np.intp)
+
+
+def spawn_generators(seed, numGenerators):
+    """Creates independent random number generators from one seed
+
+    The generators are derived from the seed's spawn key rather than with
+    SeedSequence.spawn, so the same seed always gives the same generators however
+    many times it has been used.
+
+    Parameters:
+    -----------
+    seed : int or numpy.random.SeedSequence
+        Seed the generators are derived from
+    numGenerators : int
+        Number of generators
+
+    Returns:
+    --------
+    generators : list
+        List of numpy.random.Generator, each drawing an independent stream
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return [
+        np.random.default_rng(
+            np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (i,))
+        )
+        for i in range(numGenerators)
+    ]
+
+
+def route_generators(routes, seed):
+    """Creates a random number generator for each route, keyed by the stops it visits,
+    so the same route gets the same travel time noise in every plan it is part of
+
+    Parameters:
+    -----------
+    routes : Panda dataframe or RoutePool
+        Dataframe of routes containing trip duration and stops, a RoutePool gets the
+        same generators as the same routes in a dataframe
+    seed : numpy.random.SeedSequence
+        Seed the generators are derived from, each route's key is added after the
+        keys used by spawn_generators in simulate_costs
+
+    Returns:
+    --------
+    generators : list
+        List of numpy.random.Generator, one for each route
+    """
+    if isinstance(routes, RoutePool):
+        stopNames = routes.stop_names()
+    else:
+        stops = [column for column in routes.columns if column in stopColumns]
+        stopNames = routes[stops].itertuples(index=False, name=None)
+    generators = []
+    for route in stopNames:
+        key = zlib.crc32("|".join(s for s in route if isinstance(s, str)).encode())
+        routeSeed = np.random.SeedSequence(
+            seed.entropy, spawn_key=seed.spawn_key + (2, key)
+        )
+        generators.append(np.random.default_rng(routeSeed))
+
+    return generators
+
+
+def travel_factors(
+    sectors, simulations, correlation, sectorRng, routeRngs, numSectors=3
+):
+    """Draws the random factor multiplying each route's travel time in each simulation
+
+    The log of each factor is normal, made up of a part shared by every route in the
+    same sector and a part for the route alone, so that routes in a sector are slowed
+    down by traffic together.
+
+    Parameters:
+    -----------
+    sectors : 1d Array
+        Sector number of each route
+    simulations : int
+        Number of simulations
+    correlation : float
+        Correlation between the log factors of two routes in the same sector
+        (0 gives every route its own independent factor)
+    sectorRng : numpy.random.Generator
+        Generator for the noise shared by each sector
+    routeRngs : list
+        Generator for the noise of each route
+    numSectors : int
+        Number of sectors, the same number of sector draws is made whichever
+        sectors the routes are in
+
+    Returns:
+    --------
+    factors : 2d Array
+        Array of the factor of each route (columns) in each simulation (rows)
+    """
+    sectorNoise = sectorRng.standard_normal((simulations, numSectors + 1))
+    routeNoise = np.empty((simulations, len(sectors)))
+    for r, routeRng in enumerate(routeRngs):
+        routeNoise[:, r] = routeRng.standard_normal(simulations)
+
+    # routes in no sector (-1) use the last column of sector noise
+    noise = (
+        np.sqrt(correlation) * sectorNoise[:, sectors]
+        + np.sqrt(1 - correlation) * routeNoise
+    )
+
+    return np.exp(mu + sigma * noise)
+
+
+def simulate_costs(
+    routes,
+    demand,
+    isSaturday,
+    simulations,
+    coordinates=None,
+    correlation=0.0,
+    chunkSize=100000,
+    seed=seed,
+    rates=None,
+):
+    """Simulates the total cost of a routing plan with both random demand and random
+    travel times
+
+    In each simulation the demand of each store is drawn as in simulate_demands, and
+    the unloading time of each route is recalculated from it. The travel time of each
+    route is multiplied by its own lognormal factor, correlated within sectors if
+    coordinates are given. The cost of every route's time, costed as in the LP, and
+    the cost of wet leasing a truck for every route over capacity are then added up.
+
+    Parameters:
+    -----------
+    routes : Panda dataframe or RoutePool
+        Dataframe of the chosen routes containing trip duration, demand and stops
+    demand : Panda dataframe
+        Dataframe containing the demands for each store for both weekdays and weekend
+    isSaturday : Boolean
+        Boolean equalling true if the routes are for a saturday
+    simulations : int
+        Number of times to simulate the plan
+    coordinates : Panda dataframe
+        Dataframe of store locations, used to correlate travel times within sectors
+    correlation : float
+        Correlation between the travel time of routes in the same sector
+    chunkSize : int
+        Number of simulations run at once, to bound memory use
+    seed : int or numpy.random.SeedSequence
+        Seed of the simulation, demand, sector and route noise are drawn from
+        separate streams derived from it so two plans simulated with the same
+        seed see the same store demands, sector traffic and noise on shared routes
+    rates : Dict
+        Rates the routes are costed with, as in the LP (Woolworths_LP.costRates if
+        not given)
+
+    Returns:
+    --------
+    costs : 1d Array
+        Total cost of the plan in each simulation
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    demandRng, sectorRng = spawn_generators(seed, 2)
+    routeRngs = route_generators(routes, seed)
+    # time spent travelling on each route, without the planned unloading time
+    travelDuration = travel_and_unload(routes)[0]
+
+    if coordinates is None:
+        sectors = np.zeros(len(routes), dtype=np.intp)
+        correlation = 0.0
+    else:
+        sectors = route_sectors(routes, coordinates)
+
+    costs = np.empty(simulations)
+    for start in range(0, simulations, chunkSize):
+        numSimulations = min(chunkSize, simulations - start)
+
+        # random demand, and the random travel time with the unloading time for that demand
+        routeDemands = simulate_demands(
+            routes, demand, isSaturday, numSimulations, demandRng
+        )
+        factors = travel_factors(
+            sectors, numSimulations, correlation, sectorRng, routeRngs
+        )
+        durations = travelDuration * factors + unloadTime * routeDemands
+
+        # costed the same way as the routes in the LP, plus a wet leased truck for
+        # each route over capacity
+        routeCosts = duration_costs(durations, rates).sum(axis=1)
+        costs[start : start + numSimulations] = routeCosts + demand_costs(
+            routeDemands, rates
+        )
+
+    return costs
+
+
+def compare_plans(
+    plans,
+    demand,
+    isSaturday,
+    simulations,
+    coordinates=None,
+    correlation=0.0,
+    seed=seed,
+    commonRandomNumbers=True,
+):
+    """Simulates the cost of several routing plans for the same day
+
+    With common random numbers every plan is simulated from the same seed, so the
+    plans are compared on identical store demands and traffic, and the
+    differences between their costs vary far less than the costs themselves.
+    Otherwise each plan gets its own independent seed derived from seed.
+
+    Parameters:
+    -----------
+    plans : list
+        List of dataframes of the chosen routes of each plan
+    demand : Panda dataframe
+        Dataframe containing the demands for each store for both weekdays and weekend
+    isSaturday : Boolean
+        Boolean equalling true if the routes are for a saturday
+    simulations : int
+        Number of times to simulate each plan
+    coordinates : Panda dataframe
+        Dataframe of store locations, used to correlate travel times within sectors
+    correlation : float
+        Correlation between the travel time of routes in the same sector
+    seed : int or numpy.random.SeedSequence
+        Seed of the simulations
+    commonRandomNumbers : Boolean
+        Boolean equalling true to simulate every plan on the same random draws
+
+    Returns:
+    --------
+    costs : 2d Array
+        Array of the cost of each plan (rows) in each simulation (columns)
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    if commonRandomNumbers:
+        seeds = [seed] * len(plans)
+    else:
+        seeds = [
+            np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (p,))
+            for p in range(len(plans))
+        ]
+
+    return np.array(
+        [
+            simulate_costs(
+                plan,
+                demand,
+                isSaturday,
+                simulations,
+                coordinates,
+                correlation,
+                seed=planSeed,
+            )
+            for plan, planSeed in zip(plans, seeds)
+        ]
+    )
+
+
+def _simulate_chunk(job):
+    """Simulates one chunk of a plan and returns the summary of its costs"""
+    (
+        routes,
+        demand,
+        isSaturday,
+        numSimulations,
+        coordinates,
+        correlation,
+        chunkSeed,
+        binEdges,
+    ) = job
+    accumulator = CostAccumulator(binEdges)
+    accumulator.add(
+        simulate_costs(
+            routes,
+            demand,
+            isSaturday,
+            numSimulations,
+            coordinates,
+            correlation,
+            seed=chunkSeed,
+        )
+    )
+
+    return accumulator
+
+
+def run_parallel(
+    routes,
+    demand,
+    isSaturday,
+    simulations,
+    coordinates=None,
+    correlation=0.0,
+    seed=seed,
+    chunkSize=100000,
+    workers=None,
+    binEdges=None,
+    numBins=1000,
+):
+    """Simulates the cost of a routing plan in chunks spread over a pool of processes,
+    merging the chunks' summaries as they arrive rather than keeping every cost
+
+    Each chunk has its own seed derived from seed and its chunk number, so the
+    results do not depend on the number of workers, and plans run with the same
+    seed and chunkSize still share random numbers chunk by chunk.
+
+    Parameters:
+    -----------
+    routes : Panda dataframe
+        Dataframe of the chosen routes containing trip duration, demand and stops
+    demand : Panda dataframe
+        Dataframe containing the demands for each store for both weekdays and weekend
+    isSaturday : Boolean
+        Boolean equalling true if the routes are for a saturday
+    simulations : int
+        Number of times to simulate the plan
+    coordinates : Panda dataframe
+        Dataframe of store locations, used to correlate travel times within sectors
+    correlation : float
+        Correlation between the travel time of routes in the same sector
+    seed : int or numpy.random.SeedSequence
+        Seed of the simulations
+    chunkSize : int
+        Number of simulations in each chunk
+    workers : int
+        Number of processes, defaults to the number of cpus (if 1 the chunks run
+        in this process)
+    binEdges : 1d Array
+        Edges of the histogram bins, by default numBins bins spanning twice the
+        range of the costs in the first chunk
+    numBins : int
+        Number of histogram bins if binEdges is not given
+
+    Returns:
+    --------
+    accumulator : CostAccumulator
+        Summary of the costs of every simulation
+    """
+    if simulations < 1 or chunkSize < 1:
+        raise ValueError("simulations and chunkSize must be at least 1")
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    if workers is None:
+        workers = os.cpu_count()
+
+    chunks = [
+        (
+            min(chunkSize, simulations - start),
+            np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (c,)),
+        )
+        for c, start in enumerate(range(0, simulations, chunkSize))
+    ]
+
+    # the first chunk is run here so its costs can set the histogram bins
+    firstCosts = simulate_costs(
+        routes,
+        demand,
+        isSaturday,
+        chunks[0][0],
+        coordinates,
+        correlation,
+        seed=chunks[0][1],
+    )
+    if binEdges is None:
+        binEdges = default_bins(firstCosts, numBins)
+    accumulator = CostAccumulator(binEdges)
+    accumulator.add(firstCosts)
+
+    jobs = [
+        (
+            routes,
+            demand,
+            isSaturday,
+            numSimulations,
+            coordinates,
+            correlation,
+            chunkSeed,
+            binEdges,
+        )
+        for numSimulations, chunkSeed in chunks[1:]
+    ]
+    if workers == 1:
+        for job in jobs:
+            accumulator.merge(_simulate_chunk(job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunkAccumulator in executor.map(_simulate_chunk, jobs):
+                accumulator.merge(chunkAccumulator)
+
+    return accumulator
+
+
+if __name__ == "__main__":
+    # Loads in data
+    Weekday_Routes, Weekend_Routes, storeLocations, demand = load_simulation_data()
+    coordinates = pd.read_csv(locationFile)
+
+    # Solves for optimal routes using Woolworths_LP
+    status, weekdayMinCost, weekdaySolved = solve_lp(Weekday_Routes, storeLocations)
+    status, satMinCost, satSolved = solve_lp(Weekend_Routes, storeLocations, True)
+
+    weekdayCost = simulate_costs(
+        weekdaySolved, demand, False, simulations, coordinates, 0.5
+    )
+    satCost = simulate_costs(satSolved, demand, True, simulations, coordinates, 0.5)
+
+    # Calculates the minimum, mean, and maximum values of costs and their confidence intervals
+    for day, cost in (("weekdays", weekdayCost), ("saturdays", satCost)):
+        interval = st.norm.interval(0.95, loc=cost.mean(), scale=st.sem(cost))
+        print(
+            "Costs for", day, "(min,mean,max):", (cost.min(), cost.mean(), cost.max())
+        )
+        print("95% Confidence Interval for", day, interval)
+
+    # Compares the weekday plan with the plan after closing two stores on the same draws
+    closed = ["Countdown Highland Park", "Countdown Northwest"]
+    closedSolved = solve_scenario(
+        solve_route_model(Weekday_Routes, storeLocations), closed
+    ).routes
+    planCosts = compare_plans(
+        [weekdaySolved, closedSolved], demand, False, simulations, coordinates, 0.5
+    )
+    saving = planCosts[0] - planCosts[1]
+    interval = st.norm.interval(0.95, loc=saving.mean(), scale=st.sem(saving))
+    print("95% Confidence Interval for weekday saving from closing", closed, interval)
@@ -1,20 +1,26 @@
 import numpy as np
 import pandas as pd
 from Woolworths_LP import *
-import statistics as stats
+import Route_Cache
+from Simulation_Stats import run_to_precision
 
 np.set_printoptions(threshold=sys.maxsize)
 pd.set_option("display.max_rows", None)
 
 simulations = 1000
-np.random.seed(100)
+seed = 100
 
-def load_data():
+# Generator used when no rng is given, seeded once so that each call draws new values
+defaultRng = np.random.default_rng(seed)
+
+def load_data(useCache=True):
     """Loads data from csv files for routes, locations, and demands
 
     Parameters:
     -----------
-    none
+    useCache : Boolean
+        Boolean equalling true to load the routes from the route cache, generating
+        them if the input files have changed, rather than from the route csv files
 
     Returns:
     --------
@@ -30,60 +36,158 @@ def load_data():
     """
 
     # Read files and convert into panda dataframes
-    Weekday_Routes = pd.read_csv("Weekday_Routes.csv")
-    Weekend_Routes = pd.read_csv("Weekend_Routes.csv")
+    if useCache:
+        Weekday_Routes, Weekend_Routes = Route_Cache.cached_routes()
+    else:
+        Weekday_Routes = pd.read_csv("Weekday_Routes.csv")
+        Weekend_Routes = pd.read_csv("Weekend_Routes.csv")
     storeLocations = pd.read_csv("WoolworthsDemands.csv", usecols=[0])
     demand = pd.read_csv("Formatted Demands.csv")
 
     return Weekday_Routes, Weekend_Routes, storeLocations, demand
 
 
-def demand_simulator(routes, demand, isSaturday):
-    """Calculates the demand for inputted routes, randomly decided using 1 of the
-    given data points for that day.
+def simulate_demands(routes, demand, isSaturday, simulations, rng=None):
+    """Simulates the demand of every route many times at once, with each store's
+    demand randomly decided using 1 of the given data points for that day.
 
     Parameters:
     -----------
-    routes : Panda dataframe
+    routes : Panda dataframe or RoutePool
         Dataframe of pre written routes containing trip duration and stops
     demand : Panda dataframe
         Dataframe containing the demands for each store for both weekdays and weekend
     isSaturday : Boolean
         Boolean equalling true if this route is for the weekend
+    simulations : int
+        Number of times to simulate the demand
+    rng : numpy.random.Generator
+        Random number generator to draw from, defaultRng if not given
 
     Returns:
     --------
-    routes : Panda dataframe
-        Dataframe containing the route time length, total demand, and stops visited
-        Note, the duration values are still based off of the orginal demand and have
-        not been recalculated
+    routeDemands : 2d Array
+        Array of the simulated demand of each route (columns) in each simulation (rows)
     """
-    
-    # Defines shape of arrays
-    rows, cols = routes.shape
-    demandRows, demandCols = demand.shape
 
-    # Establishes which demand values to use
+    # Establishes which demand values to use, the first and last columns of the day
     if isSaturday:
         demandColMin = 22
         demandColMax = 25
     else:
         demandColMin = 1
         demandColMax = 21
-    # Sets each value in the "demand" column to the routes dataframe to 0
-    routes["Demand"] = 0
-
-    # Loops through each of the routes adding their demand, and the time taken to unload packages
-    # (which is based off of demand)
-    # Stops searching once the correct demand is found and does not check nans
-    for i in range(0, rows):
-        for j in range(3, 6):
-            currentStore = routes.iloc[i, j]
-            if not pd.isna(currentStore):
-                for k in range(0, demandRows):
-                    if currentStore == demand.iloc[k, 0]:
-                        demandCol = np.random.randint(demandColMin, demandColMax)
-                        routes.iloc[i, 1] += demand.iloc[k, demandCol]                        
+
+    if rng is None:
+        rng = defaultRng
+
+    # Draws one of the day's data points for every store in every simulation in one go,
+    # always for every store in the table so plans with different routes share draws
+    demandValues = demand.iloc[:, 1:].to_numpy(dtype=np.float64)
+    numStores = len(demandValues)
+    demandCols = rng.integers(
+        demandColMin, demandColMax, size=(simulations, numStores), endpoint=True
+    )
+    storeDemands = demandValues[np.arange(numStores), demandCols - 1]
+
+    # Adds up the demand of the stores on each route, using the matrix of which routes visit which stores
+    routeVisits = column_generation(routes, demand.iloc[:, [0]])
+    routeDemands = np.asarray((routeVisits.T @ storeDemands.T).T)
+
+    return routeDemands
+
+
+def demand_costs(routeDemands, rates=None):
+    """Evaluates simulated demands for routes testing if they are above truck capacity.
+        The cost of wet leasing a truck is added for each route above capacity.
+
+    Parameters:
+    -----------
+    routeDemands : 2d Array
+        Array of the simulated demand of each route (columns) in each simulation (rows)
+    rates : Dict
+        Wet lease cost and truck capacity, Woolworths_LP.costRates if not given
+
+    Returns:
+    --------
+    costs : 1d Array
+        Additional cost of extra trucks for routes in each simulation
+    """
+    if rates is None:
+        rates = costRates
+
+    return rates["wetLeaseCost"] * (routeDemands > rates["truckCapacity"]).sum(axis=1)
+
+
+def adaptive_demand_simulation(routes, demand, isSaturday, tolerance=None,
+                               relTolerance=None, confidence=0.95, batchSize=1000,
+                               maxSimulations=1000000, rng=None):
+    """Simulates the additional cost of extra trucks in batches until the confidence
+    interval of the mean cost is narrower than a given tolerance.
+
+    Parameters:
+    -----------
+    routes : Panda dataframe
+        Dataframe of pre written routes containing trip duration and stops
+    demand : Panda dataframe
+        Dataframe containing the demands for each store for both weekdays and weekend
+    isSaturday : Boolean
+        Boolean equalling true if this route is for the weekend
+    tolerance : float
+        Largest half-width of the confidence interval in dollars
+    relTolerance : float
+        Largest half-width of the confidence interval as a fraction of the mean cost
+    confidence : float
+        Confidence level of the interval
+    batchSize : int
+        Number of simulations run between checks of the interval
+    maxSimulations : int
+        Most simulations run if the tolerance is not reached
+    rng : numpy.random.Generator
+        Random number generator to draw from, a new one seeded with seed if not given
+
+    Returns:
+    --------
+    accumulator : CostAccumulator
+        Summary of the costs, where accumulator.count is the number of simulations run
+    converged : Boolean
+        Boolean equalling true if the tolerance was reached
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+
+    return run_to_precision(
+        lambda n: demand_costs(simulate_demands(routes, demand, isSaturday, n, rng)),
+        tolerance, relTolerance, confidence, batchSize, maxSimulations)
+
+
+def demand_simulator(routes, demand, isSaturday, rng=None):
+    """Calculates the demand for inputted routes, randomly decided using 1 of the
+    given data points for that day.
+
+    Parameters:
+    -----------
+    routes : Panda dataframe or RoutePool
+        Dataframe of pre written routes containing trip duration and stops
+    demand : Panda dataframe
+        Dataframe containing the demands for each store for both weekdays and weekend
+    isSaturday : Boolean
+        Boolean equalling true if this route is for the weekend
+    rng : numpy.random.Generator
+        Random number generator to draw from, defaultRng if not given
+
+    Returns:
+    --------
+    routes : Panda dataframe or RoutePool
+        Dataframe containing the route time length, total demand, and stops visited
+        Note, the duration values are still based off of the orginal demand and have
+        not been recalculated
+    """
+    routeDemand = simulate_demands(routes, demand, isSaturday, 1, rng)[0]
+    if isinstance(routes, Route_Generation.RoutePool):
+        return Route_Generation.RoutePool(routes.stops, routes.duration, routeDemand, routes.stores)
+
+    routes["Demand"] = routeDemand
 
     return routes
 
@@ -95,7 +199,7 @@ def demand_evaluator(routes, minCost):
 
     Parameters:
     -----------
-    routes : Panda dataframe
+    routes : Panda dataframe or RoutePool
         Dataframe of pre written routes containing trip duration and stops
     minCost : Double
         Value representing the current minimum cost of a route, set to 0 
@@ -106,40 +210,38 @@ def demand_evaluator(routes, minCost):
     minCost : Double
         Number representing the additional cost of extra trucks for routes
     """    
-    
-    # Defines shape of arrays
-    rows, cols = routes.shape
-
-    # Loops through routes testing if any routes are over capacity, if they
-    # are the cost is increased
-    for i in range(0,rows):
-        if routes.iloc[i,1] > 26:
-            minCost += 2000
-    
-    return minCost
+    if isinstance(routes, Route_Generation.RoutePool):
+        routeDemand = routes.demand
+    else:
+        routeDemand = routes["Demand"].to_numpy()
+
+    return minCost + demand_costs(routeDemand[None, :])[0]
 
 if __name__ == "__main__":
     # Loads in data
     Weekday_Routes, Weekend_Routes, storeLocations, demand = load_data()
     
-    # Solves for optimal routes using Woolworths_LP
-    status, weekdayMinCost, weekdaySolved = solve_lp(Weekday_Routes, storeLocations)
-    status, satMinCost, satSolved = solve_lp(Weekend_Routes, storeLocations, True)
-
-    # Preinitializes arrays of costs
-    weekdayCost = [0] * simulations
-    satCost = [0] * simulations
+    # Solves for optimal weekday and saturday routes at the same time using Woolworths_LP
+    scenarios = [(Weekday_Routes, "Weekday Demand", maxTrucks, ()),
+                 (Weekend_Routes, "Saturday Demand", maxTrucks, ())]
+    solved = {}
+    for i, status, minCost, routes, stats in solve_many(scenarios, storeLocations=storeLocations):
+        solved[i] = routes
+    weekdaySolved, satSolved = solved[0], solved[1]
 
     # Runs the given number of simulations for weekday and saturday evaluations
-    for i in range(0,simulations):
-        simulationWeekday = demand_simulator(weekdaySolved, demand, False)
-        weekdayCost[i] = demand_evaluator(simulationWeekday, 0)
-        simulationSat = demand_simulator(satSolved, demand, True)
-        satCost[i] = demand_evaluator(simulationSat, 0)
+    rng = np.random.default_rng(seed)
+    weekdayCost = demand_costs(simulate_demands(weekdaySolved, demand, False, simulations, rng))
+    satCost = demand_costs(simulate_demands(satSolved, demand, True, simulations, rng))
 
     # Calculates the minimum, mean, and maximum valeus of costs
-    weekRange = [(min(weekdayCost),stats.mean(weekdayCost),max(weekdayCost))]
-    satRange = [(min(satCost),stats.mean(satCost),max(satCost))]
+    weekRange = [(weekdayCost.min(), weekdayCost.mean(), weekdayCost.max())]
+    satRange = [(satCost.min(), satCost.mean(), satCost.max())]
 
     print("Additional costs for travel durations weekdays (min,mean,max):", weekRange)
-    print("Additional costs for travel durations saturdays (min,mean,max):", satRange)
\ No newline at end of file
+    print("Additional costs for travel durations saturdays (min,mean,max):", satRange)
+
+    # Runs simulations until the mean weekday cost is known to within $50
+    accumulator, converged = adaptive_demand_simulation(weekdaySolved, demand, False, tolerance=50, rng=rng)
+    print("Weekday additional cost 95% Confidence Interval", accumulator.interval(),
+          "after", accumulator.count, "simulations")
\ No newline at end of file
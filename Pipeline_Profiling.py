@@ -0,0 +1,193 @@
+import argparse
+import cProfile
+import contextlib
+import functools
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+
+# File the report of a profiled run is written to
+reportFile = "profile_report.json"
+
+
+class Profiler:
+    """Times the stages of the routing pipeline and counts what they work on
+
+    Stages are timed with the stage context manager or the timed decorator, and
+    each stage's calls and seconds are added up over the run. The seconds of a
+    stage include any stages run inside it (a stage run inside itself, such as
+    loading the csv files while loading the routes, is only counted once), and its
+    selfSeconds leave them out, so the selfSeconds of all stages add up to at most
+    the time of the run. If profileDir is set, each stage that is not
+    inside another stage is also run under cProfile, with the statistics of every
+    call written to <profileDir>/<stage>.prof (and <stage>_<n>.prof for its n-th
+    profiled call after the first).
+
+    Parameters:
+    -----------
+    profileDir : String
+        Directory for the cProfile statistics, or None to not run cProfile
+    """
+
+    def __init__(self, profileDir=None):
+        self.profileDir = profileDir
+        self.reset()
+
+    def reset(self):
+        """Clears the times and counts, starting a new run"""
+        self.stages = {}
+        self.counters = {}
+        self.profiled = {}
+        self.started = datetime.now()
+        self.start = time.perf_counter()
+        # [name, seconds of the stages run inside it] of each stage running
+        self.active = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager timing the block as the stage name"""
+        profile = None
+        if self.profileDir is not None and not self.active:
+            profile = cProfile.Profile()
+        record = self.stages.setdefault(
+            name, {"calls": 0, "seconds": 0.0, "selfSeconds": 0.0}
+        )
+        outermost = all(running != name for running, _ in self.active)
+
+        frame = [name, 0.0]
+        self.active.append(frame)
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            self.active.pop()
+            if outermost:
+                record["seconds"] += seconds
+            record["selfSeconds"] += seconds - frame[1]
+            record["calls"] += 1
+            if self.active:
+                self.active[-1][1] += seconds
+            if profile is not None:
+                os.makedirs(self.profileDir, exist_ok=True)
+                count = self.profiled[name] = self.profiled.get(name, 0) + 1
+                suffix = "" if count == 1 else f"_{count}"
+                profile.dump_stats(
+                    os.path.join(self.profileDir, f"{name}{suffix}.prof")
+                )
+
+    def timed(self, name):
+        """Decorator timing every call of a function as the stage name"""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name, amount=1):
+        """Adds amount to the counter name"""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self):
+        """Returns the times of the stages and the counters as a dictionary"""
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "seconds": time.perf_counter() - self.start,
+            "stages": {name: dict(record) for name, record in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def write_report(self, path=reportFile):
+        """Writes the report to a json file"""
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+
+    def table(self):
+        """Returns the report as a table of the stages followed by the counters,
+        with each stage's share of the run worked out from its self seconds"""
+        report = self.report()
+        lines = [
+            f"{'stage':<24}{'calls':>8}{'seconds':>12}{'self':>12}{'% of run':>10}"
+        ]
+        for name, record in report["stages"].items():
+            share = 100 * record["selfSeconds"] / report["seconds"]
+            lines.append(
+                f"{name:<24}{record['calls']:>8}{record['seconds']:>12.4f}"
+                f"{record['selfSeconds']:>12.4f}{share:>10.1f}"
+            )
+        lines.append(f"{'total':<24}{'':>8}{report['seconds']:>12.4f}{'':>12}")
+        if report["counters"]:
+            lines.append("")
+            lines.append(f"{'counter':<24}{'count':>8}")
+            for name, count in report["counters"].items():
+                lines.append(f"{name:<24}{count:>8}")
+
+        return "\n".join(lines)
+
+
+# Profiler the pipeline's stages are timed with
+profiler = Profiler()
+
+
+def profile_pipeline(workers=None, profileDir=None, path=reportFile):
+    """Generates the routes and solves both days' models, reporting each stage
+
+    Parameters:
+    -----------
+    workers : int
+        Number of processes to generate routes with (stages run in worker processes
+        are not timed separately)
+    profileDir : String
+        Directory for cProfile statistics of each stage, or None to not run cProfile
+    path : String
+        File the json report is written to
+
+    Returns:
+    --------
+    report : Dict
+        Times of the stages and the counters
+    """
+    import Route_Generation
+    import Woolworths_LP
+
+    profiler.profileDir = profileDir
+    profiler.reset()
+
+    weekdayRoutes, weekendRoutes = Route_Generation.generate_all_routes(workers)
+    with profiler.stage("load"):
+        storeLocations = pd.read_csv("WoolworthsDemands.csv", usecols=[0])
+    Woolworths_LP.solve_lp(weekdayRoutes, storeLocations, cache=None)
+    Woolworths_LP.solve_lp(weekendRoutes, storeLocations, True, cache=None)
+
+    profiler.write_report(path)
+    return profiler.report()
+
+
+if __name__ == "__main__":
+    import Pipeline_Profiling
+
+    parser = argparse.ArgumentParser(
+        description="Times each stage of generating routes and solving the models"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--profile-dir", default=None, help="write cProfile stats")
+    parser.add_argument("--output", default=reportFile)
+    arguments = parser.parse_args()
+
+    # uses the module the pipeline imports, rather than this script's copy of it
+    Pipeline_Profiling.profile_pipeline(
+        arguments.workers, arguments.profile_dir, arguments.output
+    )
+    print(Pipeline_Profiling.profiler.table())
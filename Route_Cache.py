@@ -0,0 +1,142 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import Route_Generation
+from Route_Generation import RoutePool, demandFile, locationFile, travelDurationFile
+
+# Directory the generated route pools are stored in
+cacheDir = ".route_cache"
+
+# Files the route pools are generated from, including the generator itself so
+# changes to how routes are made also invalidate the cache
+inputFiles = [travelDurationFile, locationFile, demandFile, Route_Generation.__file__]
+
+
+def input_hash(maxStops=4, exhaustive=False, files=None):
+    """Returns a hash of the contents of the input files and the generation parameters
+
+    Parameters:
+    -----------
+    maxStops : int
+        Largest number of stores visited on a route
+    exhaustive : Boolean
+        Boolean equalling true if every set of stores in a sector is enumerated
+    files : list
+        Paths of the files the routes are generated from, inputFiles if not given
+
+    Returns:
+    --------
+    key : string
+        Hex digest identifying the route pools these inputs generate
+    """
+    if files is None:
+        files = inputFiles
+
+    digest = hashlib.sha256()
+    for path in files:
+        with open(path, "rb") as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+    digest.update(repr((maxStops, bool(exhaustive))).encode())
+
+    return digest.hexdigest()
+
+
+def save_routes(path, weekdayRoutes, weekendRoutes):
+    """Saves the weekday and saturday route pools to one npz file
+
+    Each day is stored as the arrays of a RoutePool, so loading needs no csv parsing.
+
+    Parameters:
+    -----------
+    path : string
+        File to write, written to a temporary file first so a partly written
+        cache is never read
+    weekdayRoutes, weekendRoutes : Panda dataframe or RoutePool
+        Routes with their duration, demand and stops
+    """
+    arrays = {}
+    for day, routes in (("weekday", weekdayRoutes), ("weekend", weekendRoutes)):
+        if not isinstance(routes, RoutePool):
+            routes = RoutePool.from_dataframe(routes)
+        arrays.update(routes.to_arrays(day + "_"))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    file, tempPath = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(file, "wb") as handle:
+            np.savez(handle, **arrays)
+        os.replace(tempPath, path)
+    except BaseException:
+        os.remove(tempPath)
+        raise
+
+
+def load_routes(path, pools=False):
+    """Loads the weekday and saturday route pools saved by save_routes
+
+    Parameters:
+    -----------
+    path : string
+        File written by save_routes
+    pools : Boolean
+        Boolean equalling true to return RoutePools rather than dataframes
+
+    Returns:
+    --------
+    weekdayRoutes : Panda dataframe or RoutePool
+        Weekday routes with their duration, demand and stops
+    weekendRoutes : Panda dataframe or RoutePool
+        Saturday routes with their duration, demand and stops
+    """
+    with np.load(path) as data:
+        dayRoutes = [
+            RoutePool.from_arrays(data, day + "_") for day in ("weekday", "weekend")
+        ]
+
+    if not pools:
+        dayRoutes = [routes.to_dataframe() for routes in dayRoutes]
+
+    return dayRoutes[0], dayRoutes[1]
+
+
+def cached_routes(
+    maxStops=4, exhaustive=False, workers=None, directory=None, pools=False
+):
+    """Returns the weekday and saturday route pools, generating them only if the
+    input files or parameters have changed since they were last cached
+
+    Parameters:
+    -----------
+    maxStops : int
+        Largest number of stores visited on a route
+    exhaustive : Boolean
+        Boolean equalling true to enumerate every set of stores in a sector
+    workers : int
+        Number of processes to generate routes with if they are not cached
+    directory : string
+        Directory holding the cache, cacheDir if not given
+    pools : Boolean
+        Boolean equalling true to return RoutePools rather than dataframes
+
+    Returns:
+    --------
+    weekdayRoutes : Panda dataframe or RoutePool
+        Weekday routes with their duration, demand and stops
+    weekendRoutes : Panda dataframe or RoutePool
+        Saturday routes with their duration, demand and stops
+    """
+    if directory is None:
+        directory = cacheDir
+    path = os.path.join(
+        directory, "routes_" + input_hash(maxStops, exhaustive) + ".npz"
+    )
+
+    if not os.path.exists(path):
+        weekdayRoutes, weekendRoutes = Route_Generation.generate_all_routes(
+            workers, maxStops, exhaustive
+        )
+        save_routes(path, weekdayRoutes, weekendRoutes)
+
+    return load_routes(path, pools)
@@ -1,12 +1,239 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
 import pandas as pd
 
+from Pipeline_Profiling import profiler
+
 
 travelDurationFile = "WoolworthsTravelDurations.csv"
 locationFile = "WoolworthsLocations.csv"
 demandFile = "Demand by weekday.csv"
 
+# Column names for the stops of a route, in the order they are visited
+stopColumns = [
+    "First Stop",
+    "Second Stop",
+    "Third Stop",
+    "Fourth Stop",
+    "Fifth Stop",
+    "Sixth Stop",
+]
+
+# Demand columns of the demand table, indexed by whether the day is a saturday
+dayDemandColumns = ["Weekday Demand", "Saturday Demand"]
+
+# Time taken to unload one pallet in seconds
+unloadTime = 7.5 * 60
+
+
+class DurationMatrix:
+    """Travel durations between every location stored as a contiguous array,
+    with a lookup from store name to row/column index
+
+    Parameters:
+    -----------
+    values : 2d Array
+        Square matrix of travel times in seconds, values[i, j] is the time
+        taken to travel from location i to location j
+    stores : list
+        Names of the locations in row/column order
+    depot : int
+        Index of the distribution centre in values
+    """
+
+    def __init__(self, values, stores, depot):
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.stores = list(stores)
+        self.index = {store: i for i, store in enumerate(self.stores)}
+        self.depot = depot
+
+    @classmethod
+    def from_dataframe(cls, travelDurations, depotName):
+        """Builds the matrix from the travel durations csv layout, where the first
+        column holds the store names and the remaining columns the durations
+        """
+        stores = travelDurations.iloc[:, 0].tolist()
+        values = travelDurations.iloc[:, 1:].to_numpy(dtype=np.float64)
+        return cls(values, stores, stores.index(depotName))
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def lookup(self, locations):
+        """Returns an integer array of the indices of the given store names"""
+        return np.array([self.index[location] for location in locations], dtype=np.intp)
+
+
+class RoutePool:
+    """A set of routes stored as arrays, with every stop an index into one table
+    of store names
+
+    Routes are only converted to and from the dataframe layout of the route csv
+    files at the edges of the pipeline, everything in between works on the arrays.
+
+    Parameters:
+    -----------
+    stops : 2d Array
+        Indices into stores of the stops of each route (rows) in the order they are
+        visited, padded with -1 after the last stop
+    duration : 1d Array
+        Duration of each route in seconds
+    demand : 1d Array
+        Demand of each route in pallets
+    stores : list
+        Names of the stores the stops index
+    """
+
+    def __init__(self, stops, duration, demand, stores):
+        self.stops = np.asarray(stops, dtype=np.int16)
+        self.duration = np.asarray(duration, dtype=np.float32)
+        self.demand = np.asarray(demand, dtype=np.float32)
+        self.stores = np.asarray(stores, dtype=str)
+
+    def __len__(self):
+        return len(self.stops)
+
+    @classmethod
+    def from_dataframe(cls, routes, stores=None):
+        """Builds the pool from the route csv layout, with a Duration, a Demand and
+        stop columns left blank after the last stop
+
+        If stores is given the stops index it (and must all be in it), otherwise
+        the table is made of the stores the routes visit
+        """
+        stops = [column for column in routes.columns if column in stopColumns]
+        names = routes[stops].to_numpy().ravel()
+        if stores is None:
+            codes, stores = pd.factorize(names)
+        else:
+            codes = pd.Index(stores).get_indexer(names)
+            if (codes[pd.notna(names)] == -1).any():
+                raise ValueError("routes visit stores that are not in stores")
+        demand = routes["Demand"] if "Demand" in routes else np.zeros(len(routes))
+
+        return cls(
+            codes.reshape(len(routes), len(stops)),
+            routes["Duration"].to_numpy(dtype=np.float64),
+            np.asarray(demand, dtype=np.float64),
+            stores,
+        )
+
+    def to_dataframe(self):
+        """Returns the routes in the route csv layout, with blank stops as NaN"""
+        # Index -1 pads routes with fewer stops, and maps to NaN
+        storeNames = np.append(self.stores.astype(object), np.nan)
+        demand = self.demand
+        if np.array_equal(demand, np.round(demand)):
+            demand = demand.astype(np.int64)
+
+        routes = pd.DataFrame(
+            {"Duration": self.duration.astype(np.float64), "Demand": demand}
+        )
+        for k in range(self.stops.shape[1]):
+            routes[stopColumns[k]] = storeNames[self.stops[:, k]]
+
+        return routes
+
+    def take(self, indices):
+        """Returns the pool of the routes at the given positions"""
+        return RoutePool(
+            self.stops[indices], self.duration[indices], self.demand[indices], self.stores
+        )
+
+    @classmethod
+    def concat(cls, pools):
+        """Joins pools into one, with the stops indexing the stores of every pool
+        and routes with fewer stops than the longest padded with -1"""
+        stores = pd.unique(np.concatenate([pool.stores for pool in pools]))
+        width = max(pool.stops.shape[1] for pool in pools)
+        stops = np.full((sum(len(pool) for pool in pools), width), -1, dtype=np.int16)
+        start = 0
+        for pool in pools:
+            stops[start : start + len(pool), : pool.stops.shape[1]] = pool.store_rows(stores)
+            start += len(pool)
+
+        return cls(
+            stops,
+            np.concatenate([pool.duration for pool in pools]),
+            np.concatenate([pool.demand for pool in pools]),
+            stores,
+        )
+
+    def stop_names(self):
+        """Returns the name of each stop of each route, None for blank stops"""
+        return np.append(self.stores.astype(object), None)[self.stops]
+
+    def store_rows(self, storeNames):
+        """Returns the stops as rows of another table of store names, with -1 for
+        blank stops and stores that are not in the table
+
+        Only the store table is looked up by name, the stops are then mapped with
+        one array operation.
+        """
+        rows = np.append(pd.Index(storeNames).get_indexer(self.stores), -1)
+
+        return rows[self.stops]
+
+    def to_arrays(self, prefix=""):
+        """Returns the arrays of the pool keyed for np.savez, with prefix before each name"""
+        return {
+            prefix + "stops": self.stops,
+            prefix + "duration": self.duration,
+            prefix + "demand": self.demand,
+            prefix + "stores": self.stores,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=""):
+        """Builds the pool from arrays saved from to_arrays"""
+        return cls(
+            arrays[prefix + "stops"],
+            arrays[prefix + "duration"],
+            arrays[prefix + "demand"],
+            arrays[prefix + "stores"],
+        )
+
+    def save(self, path):
+        """Saves the pool to an npz file"""
+        with open(path, "wb") as file:
+            np.savez(file, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        """Loads a pool saved with save"""
+        with np.load(path) as data:
+            return cls.from_arrays(data)
+
+
+def travel_and_unload(routes):
+    """Returns the time each route spends travelling and unloading
+
+    Parameters:
+    -----------
+    routes : Panda dataframe or RoutePool
+        Routes with their duration and demand
+
+    Returns:
+    --------
+    travelDuration : 1d Array
+        Time spent travelling on each route in seconds
+    unloadDuration : 1d Array
+        Time spent unloading on each route in seconds
+    """
+    if isinstance(routes, RoutePool):
+        duration, demand = routes.duration, routes.demand
+    else:
+        duration, demand = routes["Duration"].to_numpy(), routes["Demand"].to_numpy()
+    unloadDuration = unloadTime * np.asarray(demand, dtype=np.float64)
 
+    return np.asarray(duration, dtype=np.float64) - unloadDuration, unloadDuration
+
+
+@profiler.timed("load")
 def load_data():
     """Returns travel durations and coordinates for stores.
 
@@ -16,8 +243,8 @@ def load_data():
 
     Returns:
     --------
-    travelDurations : Panda dataframe
-        Dataframe of the travel times between each of the stores 
+    travelDurations : DurationMatrix
+        Matrix of the travel times between each of the stores 
         and the distribution center
     coordinates : Panda dataframe
         Dataframe containing coordinates of each store's locations
@@ -31,6 +258,10 @@ def load_data():
     coordinates = pd.read_csv(locationFile)
     demand = pd.read_csv(demandFile)
 
+    # The depot is the one location of type "Distribution Centre", stores have other types
+    depotName = coordinates.loc[coordinates["Type"] == "Distribution Centre", "Store"].iloc[0]
+    travelDurations = DurationMatrix.from_dataframe(travelDurations, depotName)
+
     return travelDurations, coordinates, demand
 
 
@@ -71,13 +302,52 @@ def group_coordinates(coordinates):
     return southLocations, eastLocations, westLocations
 
 
+def check_stop_count(numStops):
+    """Raises a ValueError if routes of numStops stops have no column for every stop"""
+    if numStops > len(stopColumns):
+        raise ValueError(
+            f"routes can have at most {len(stopColumns)} stops, one for each of "
+            f"stopColumns, not {numStops}"
+        )
+
+
+def routes_dataframe(durations, totalDuration, stops):
+    """Builds the dataframe of routes from arrays of their durations and stops
+
+    Parameters:
+    -----------
+    durations : DurationMatrix
+        Matrix of travel times between each location
+    totalDuration : 1d Array
+        Duration of each route
+    stops : 2d Array
+        Matrix indices of the stops of each route, in the order they are visited,
+        padded with -1 after the last stop
+
+    Returns:
+    --------
+    routes : Panda dataframe
+        Dataframe containing the route length, and stops visited
+    """
+    check_stop_count(stops.shape[1])
+
+    # Index -1 pads routes with fewer stops, and maps to NaN
+    storeNames = np.array(durations.stores + [np.nan], dtype=object)
+
+    routes = pd.DataFrame({"Duration": totalDuration})
+    for k in range(stops.shape[1]):
+        routes[stopColumns[k]] = storeNames[stops[:, k]]
+
+    return routes
+
+
 def one_stop_route_generation(durations, locations):
     """Calculates the duration of routes to and from given locations
 
     Parameters:
     -----------
-    durations : Panda dataframe
-        Dataframe of travel times between each location
+    durations : DurationMatrix
+        Matrix of travel times between each location
     locations : list
         List of locations to visit
 
@@ -87,31 +357,126 @@ def one_stop_route_generation(durations, locations):
         Dataframe containing the route length, and stop visited
     """
 
-    # Defines shape of array
-    rows, cols = durations.shape
+    # Travel times and location of distribution center in the matrix
+    values = durations.values
+    depot = durations.depot
 
-    # Hardcoded location of distribution center in table
-    distributionVal = 55
+    # Finds the distance to and from each inputted location
+    stops = durations.lookup(locations)[:, None]
+    totalDuration = values[depot, stops[:, 0]] + values[stops[:, 0], depot]
 
-    # Creates empty panda dataframe
-    routes = pd.DataFrame(data=None, index=None, columns=["Duration", "First Stop"])
+    return routes_dataframe(durations, totalDuration, stops)
 
-    # Iterates through each inputted location
-    # and finds the distance to and from the stop
-    for location in locations:
-        for i in range(0, rows):
-            if location == durations.iloc[i, 0]:
-                distanceTo = durations.iloc[distributionVal, i + 1]
-                distanceFrom = durations.iloc[i, distributionVal + 1]
 
-        # Adds new route into the overall panda dataframe for output
-        newRoute = pd.DataFrame(
-            {"Duration": (distanceTo + distanceFrom), "First Stop": location},
-            index=["1"],
-        )
-        routes = pd.concat([routes, newRoute], ignore_index=True)
+def store_demand(durations, demand, isSaturday=False):
+    """Returns the demand of each location in the duration matrix for the given day,
+    with the distribution centre and any store missing from the demand table set to 0
 
-    return routes
+    Parameters:
+    -----------
+    durations : DurationMatrix
+        Matrix of travel times between each location
+    demand : Panda dataframe
+        Dataframe of max-mean demand for each store on weekdays and saturdays
+    isSaturday : Boolean
+        Boolean equalling true if the demand is for a saturday
+
+    Returns:
+    --------
+    storeDemand : 1d Array
+        Demand of each location, in the order of the duration matrix
+    """
+    demandCol = dayDemandColumns[int(isSaturday)]
+    storeDemand = demand.set_index("Store")[demandCol].reindex(durations.stores)
+
+    return storeDemand.fillna(0).to_numpy(dtype=np.float64, copy=True)
+
+
+def open_store_mask(durations, demand, isSaturday=False):
+    """Returns a boolean mask over the duration matrix of the stores a route may
+    visit, excluding the distribution centre and stores with no demand that day
+
+    Parameters:
+    -----------
+    durations : DurationMatrix
+        Matrix of travel times between each location
+    demand : Panda dataframe
+        Dataframe of max-mean demand for each store on weekdays and saturdays
+    isSaturday : Boolean
+        Boolean equalling true if the routes are for a saturday
+
+    Returns:
+    --------
+    openStores : 1d Array
+        Boolean array equalling true for each location that can be visited
+    """
+    openStores = store_demand(durations, demand, isSaturday) != 0
+    openStores[durations.depot] = False
+
+    return openStores
+
+
+def nearest_neighbour_route_generation(
+    durations, locations, numStops, finalStop=True, openStores=None
+):
+    """Generates routes starting at each given location which then travel to the
+    closest unvisited store until the route has the given number of stops
+    (As well as too and from the distribution center)
+
+    Every route is extended at once, with the next stop found as the masked
+    minimum of the current stop's row of the duration matrix.
+
+    Parameters:
+    -----------
+    durations : DurationMatrix
+        Matrix of travel times between each location
+    locations : list
+        List of locations to start routes from
+    numStops : int
+        Number of stores visited on each route, at most the number of stopColumns
+    finalStop : Boolean
+        Boolean equalling true if the return distance to the distribution centre
+        should be included in the duration
+    openStores : 1d Array
+        Boolean mask of the locations that can be visited after the first stop,
+        if not given every store other than the distribution centre can be visited
+
+    Returns:
+    --------
+    routes : Panda dataframe
+        Dataframe containing the route length, and stops visited
+    """
+    check_stop_count(numStops)
+    values = durations.values
+    depot = durations.depot
+
+    # Stores that can be travelled to after the first stop
+    if openStores is None:
+        openStores = np.ones(len(durations.stores), dtype=bool)
+    openStores = openStores.copy()
+    openStores[depot] = False
+
+    # Preallocates the stops of every route, starting with the given locations
+    stops = np.empty((len(locations), numStops), dtype=np.intp)
+    stops[:, 0] = durations.lookup(locations)
+    totalDuration = values[depot, stops[:, 0]].copy()
+    routeIndex = np.arange(len(locations))
+
+    # Extends every route by its closest open store that has not already been visited
+    for k in range(1, numStops):
+        candidates = np.where(openStores, values[stops[:, k - 1]], np.inf)
+        candidates[routeIndex[:, None], stops[:, :k]] = np.inf
+        stops[:, k] = np.argmin(candidates, axis=1)
+        totalDuration += candidates[routeIndex, stops[:, k]]
+
+    # If this is the final stop in the route the return distance to the distribution is added
+    if finalStop:
+        totalDuration += values[stops[:, -1], depot]
+
+    # Routes which ran out of stores to visit are dropped
+    valid = np.isfinite(totalDuration)
+
+    return routes_dataframe(durations, totalDuration[valid], stops[valid])
 
 
 def two_stop_route_generation(durations, locations, finalStop = False):
@@ -120,8 +485,8 @@ def two_stop_route_generation(durations, locations, finalStop = False):
 
     Parameters:
     -----------
-    durations : Panda dataframe
-        Dataframe of travel times between each location
+    durations : DurationMatrix
+        Matrix of travel times between each location
     locations : list
         List of locations to visit
     finalStop : Boolean
@@ -133,227 +498,87 @@ def two_stop_route_generation(durations, locations, finalStop = False):
     routes : Panda dataframe
         Dataframe containing the route length, and stops visited
     """
-    # Defines shape of array
-    rows, cols = durations.shape
-
-    # Hardcoded location of distribution center in table
-    distributionVal = 55
-
-    # Creates empty panda dataframe
-    routes = pd.DataFrame(
-        data=None, index=None, columns=["Duration", "First Stop", "Second Stop"]
-    )
-
-    # Iterates through each inputted location and finds the shortest route to the location, then the distance
-    # to the next closest location
-    for location in locations:
-        minDistance = 1.0e10
-        nextStop = ""
-        for i in range(0, rows):
-            if location == durations.iloc[i, 0]:
-                for j in range(1, cols):
-                    if (
-                        (durations.iloc[i, j] < minDistance)
-                        and (durations.iloc[i, j] > 0)
-                        and (durations.iloc[j - 1, 0] != "Distribution Centre Auckland")
-                    ):
-                        minDistance = durations.iloc[i, j]
-                        distanceTo = durations.iloc[distributionVal, i + 1]
-                        distanceFrom = durations.iloc[j - 1, distributionVal + 1]
-                        nextStop = durations.iloc[j - 1, 0]
-
-        # If this is the final stop in the route the return distance to the distribution is added
-        if finalStop:
-            totalDistance = minDistance + distanceTo + distanceFrom
-        else:
-            totalDistance = minDistance + distanceTo
-
-        # Adds new route into the overall panda dataframe for output
-        newRoute = pd.DataFrame(
-            {
-                "Duration": totalDistance,
-                "First Stop": location,
-                "Second Stop": nextStop,
-            },
-            index=["1"],
-        )
-        routes = pd.concat([routes, newRoute], ignore_index=True)
-
-    return routes
+    return nearest_neighbour_route_generation(durations, locations, 2, finalStop)
 
 
-def three_stop_route_generation(durations, locations, finalStop, isSaturday=False):
+def three_stop_route_generation(
+    durations, locations, finalStop, isSaturday=False, demand=None
+):
     """Generates three stop routes between a given location and the closet location,
     this is then routed to the next closest location
     (As well as too and from the distribution center)
 
     Parameters:
     -----------
-    durations : Panda dataframe
-        Dataframe of travel times between each location
-        (If not true, the return distance to the distribution centre will not be
-        included in the duration)
+    durations : DurationMatrix
+        Matrix of travel times between each location
     locations : list
         List of locations to visit
     finalStop : Boolean
         Boolean equalling true if this is the last stop in the route
+        (If not true, the return distance to the distribution centre will not be
+        included in the duration)
+    isSaturday : Boolean
+        Boolean equalling true if the routes are for a saturday
+    demand : Panda dataframe
+        Dataframe of demand for each store, stores without demand are not routed to
+        (read from demandFile if not given)
     Returns:
     --------
     routes : Panda dataframe
         Dataframe containing the route length, and stops visited
     """
-    isSaturday = int(isSaturday)
-    # Calls the two_stop_route_generation function to create the first stops of the route
-    two_stop_routes = two_stop_route_generation(durations, locations, False)
-
-    # Parses data outputted from the two_stop_route_generation dataframe into arrays
-    first_stops = two_stop_routes["First Stop"].values
-    second_stops = two_stop_routes["Second Stop"].values
-    currentDuration = two_stop_routes["Duration"].values
+    if demand is None:
+        demand = pd.read_csv(demandFile)
+    openStores = open_store_mask(durations, demand, isSaturday)
 
-    # Defines shape of array
-    rows, cols = durations.shape
-
-    # Hardcoded location of distribution center in table
-    distributionVal = 55
-
-    # Creates empty panda dataframe
-    routes = pd.DataFrame(
-        columns=["Duration", "First Stop", "Second Stop", "Third Stop"]
+    return nearest_neighbour_route_generation(
+        durations, locations, 3, finalStop, openStores
     )
 
-    # Iterates through each second stop in the route and finds the shortest route to the
-    # location, then the distance to the next closest location excluding the first stop
-    for i in range(0, len(second_stops)):
-        minDistance = 1.0e10
-        nextStop = ""
-        for j in range(0, rows):
-            if second_stops[i] == durations.iloc[j, 0]:
-                for k in range(1, cols):
-                    if (
-                        (durations.iloc[j, k] < minDistance)
-                        and (durations.iloc[j, k] > 0)
-                        and (durations.iloc[k - 1, 0] != first_stops[i])
-                        and (durations.iloc[k - 1, 0] != "Distribution Centre Auckland")
-                        and (demand.iloc[k - 1, isSaturday] != 0)
-                    ):
-                        minDistance = durations.iloc[j, k]
-                        distanceFrom = durations.iloc[k - 1, distributionVal + 1]
-                        nextStop = durations.iloc[k - 1, 0]
-
-        # If this is the final stop in the route the return distance to the distribution is added
-        if finalStop:
-            totalDistance = minDistance + currentDuration[i] + distanceFrom
-        else:
-            totalDistance = minDistance + currentDuration[i]
-
-        # Adds new route into the overall panda dataframe for output
-        newRoute = pd.DataFrame(
-            {
-                "Duration": totalDistance,
-                "First Stop": first_stops[i],
-                "Second Stop": second_stops[i],
-                "Third Stop": nextStop,
-            },
-            index=["1"],
-        )
-        routes = pd.concat([routes, newRoute], ignore_index=True)
-
-    return routes
 
-
-def four_stop_route_generation(durations, locations, finalStop, isSaturday=False):
+def four_stop_route_generation(
+    durations, locations, finalStop, isSaturday=False, demand=None
+):
     """Generates four stop routes between a given location and the next 3 closest locations
     (As well as too and from the distribution center)
 
     Parameters:
     -----------
-    durations : Panda dataframe
-        Dataframe of travel times between each location
-        (If not true, the return distance to the distribution centre will not be
-        included in the duration)
+    durations : DurationMatrix
+        Matrix of travel times between each location
     locations : list
         List of locations to visit
     finalStop : Boolean
         Boolean equalling true if this is the last stop in the route
+        (If not true, the return distance to the distribution centre will not be
+        included in the duration)
+    isSaturday : Boolean
+        Boolean equalling true if the routes are for a saturday
+    demand : Panda dataframe
+        Dataframe of demand for each store, stores without demand are not routed to
+        (read from demandFile if not given)
     Returns:
     --------
     routes : Panda dataframe
         Dataframe containing the route length, and stops visited
     """
-    isSaturday = int(isSaturday)
+    if demand is None:
+        demand = pd.read_csv(demandFile)
+    openStores = open_store_mask(durations, demand, isSaturday)
 
-    # Calls the three_stop_route_generation function to create the first stops of the route
-    three_stop_routes = three_stop_route_generation(
-        durations, locations, False, isSaturday
+    return nearest_neighbour_route_generation(
+        durations, locations, 4, finalStop, openStores
     )
 
-    # Parses data outputted from the three_stop_route_generation dataframe into arrays
-    first_stops = three_stop_routes["First Stop"].values
-    second_stops = three_stop_routes["Second Stop"].values
-    third_stops = three_stop_routes["Third Stop"].values
-    currentDuration = three_stop_routes["Duration"].values
-
-    # Defines shape of array
-    rows, cols = durations.shape
-
-    # Hardcoded location of distribution center in table
-    distributionVal = 55
-
-    # Creates empty panda dataframe
-    routes = pd.DataFrame(
-        columns=["Duration", "First Stop", "Second Stop", "Third Stop", "Fourth Stop"]
-    )
-
-    # Iterates through each third stop in the route and finds the shortest route to the
-    # location, then the distance to the next closest location excluding stops already visited
-    for i in range(0, len(third_stops)):
-        minDistance = 1.0e10
-        nextStop = ""
-        for j in range(0, rows):
-            if third_stops[i] == durations.iloc[j, 0]:
-                for k in range(1, cols):
-                    if (
-                        (durations.iloc[j, k] < minDistance)
-                        and (durations.iloc[j, k] > 0)
-                        and (durations.iloc[k - 1, 0] != first_stops[i])
-                        and (durations.iloc[k - 1, 0] != second_stops[i])
-                        and (durations.iloc[k - 1, 0] != "Distribution Centre Auckland")
-                        and (demand.iloc[k - 1, isSaturday] != 0)
-                    ):
-                        minDistance = durations.iloc[j, k]
-                        distanceFrom = durations.iloc[k - 1, distributionVal + 1]
-                        nextStop = durations.iloc[k - 1, 0]
-
-        # If this is the final stop in the route the return distance to the distribution is added
-        if finalStop:
-            totalDistance = minDistance + currentDuration[i] + distanceFrom
-        else:
-            totalDistance = minDistance + currentDuration[i]
-
-        # Adds new route into the overall panda dataframe for output
-        newRoute = pd.DataFrame(
-            {
-                "Duration": totalDistance,
-                "First Stop": first_stops[i],
-                "Second Stop": second_stops[i],
-                "Third Stop": third_stops[i],
-                "Fourth Stop": nextStop,
-            },
-            index=["1"],
-        )
-        routes = pd.concat([routes, newRoute], ignore_index=True)
-
-    return routes
-
 
 def combinatorics_route_generation(durations, locations):
     """Calculates the duration of every possible route between each and every given location
 
     Parameters:
     -----------
-    durations : Panda dataframe
-        Dataframe of travel times between each location
+    durations : DurationMatrix
+        Matrix of travel times between each location
     locations : list
         List of locations to visit
 
@@ -363,95 +588,209 @@ def combinatorics_route_generation(durations, locations):
         Dataframe containing the route length, and stop visited
     """
 
-    # Defines shape of array
-    rows, cols = durations.shape
+    # Travel times and location of distribution center in the matrix
+    values = durations.values
+    depot = durations.depot
+
+    # Every ordered pair of different locations, in the order (first stop, second stop)
+    indices = durations.lookup(locations)
+    first, second = np.meshgrid(indices, indices, indexing="ij")
+    different = first != second
+    stops = np.column_stack((first[different], second[different]))
+
+    # Distance to the first stop, between the stops and back from the second stop
+    totalDuration = (
+        values[depot, stops[:, 0]]
+        + values[stops[:, 0], stops[:, 1]]
+        + values[stops[:, 1], depot]
+    )
 
-    # Hardcoded location of distribution center in table
-    distributionVal = 55
+    return routes_dataframe(durations, totalDuration, stops)
 
-    # Creates empty panda dataframe
-    routes = pd.DataFrame(
-        data=None, index=None, columns=["Duration", "First Stop", "Second Stop"]
-    )
 
-    # Iterates through each location and finds every possible route between the specified locations
-    for location in locations:
-        for i in range(0, rows):
-            if location == durations.iloc[i, 0]:
-                for j in range(1, cols):
-                    if (durations.iloc[j - 1, 0] in locations) and (
-                        durations.iloc[j - 1, 0] != location
-                    ):
-                        distanceBetween = durations.iloc[i, j]
-                        distanceTo = durations.iloc[distributionVal, i + 1]
-                        distanceFrom = durations.iloc[j - 1, distributionVal + 1]
-                        nextStop = durations.iloc[j - 1, 0]
-                        # Adds new route into the overall panda dataframe for output
-                        newRoute = pd.DataFrame(
-                            {
-                                "Duration": (
-                                    distanceBetween + distanceTo + distanceFrom
-                                ),
-                                "First Stop": location,
-                                "Second Stop": nextStop,
-                            },
-                            index=["1"],
-                        )
-                        routes = pd.concat([routes, newRoute], ignore_index=True)
+def exhaustive_route_generation(
+    durations, locations, demand, maxStops=4, isSaturday=False, capacity=26
+):
+    """Generates a route for every set of up to maxStops of the given locations whose
+    total demand fits on one truck, visiting the stores in the quickest order
+    (As well as too and from the distribution center)
+
+    Sets of stores are built up one store at a time, so a set is dropped as soon as
+    its demand goes over capacity and none of its supersets are considered. The
+    quickest order is found with the Held-Karp dynamic programme: the shortest path
+    from the distribution centre through a set ending at each of its stores is
+    memoised by the set's bitmask and reused by every superset.
 
-    return routes
+    Parameters:
+    -----------
+    durations : DurationMatrix
+        Matrix of travel times between each location
+    locations : list
+        List of locations to visit, stores with no demand that day are skipped
+    demand : Panda dataframe
+        Dataframe of max-mean demand for each store on weekdays and saturdays
+    maxStops : int
+        Largest number of stores visited on a route
+    isSaturday : Boolean
+        Boolean equalling true if the routes are for a saturday
+    capacity : int
+        Number of pallets that fit on a truck
 
+    Returns:
+    --------
+    routes : Panda dataframe
+        Dataframe containing the route length, and stops visited
+        (routes with fewer than maxStops stops have NaN in the remaining columns)
+    """
+    values = durations.values
+    depot = durations.depot
+
+    # Only stores with demand on the day are routed to
+    openStores = open_store_mask(durations, demand, isSaturday)
+    indices = [i for i in durations.lookup(locations) if openStores[i]]
+    loads = store_demand(durations, demand, isSaturday)[indices]
+    n = len(indices)
+
+    # Travel times between the locations being routed, and to and from the depot
+    between = values[np.ix_(indices, indices)]
+    fromDepot = values[depot, indices]
+    toDepot = values[indices, depot]
+
+    # best[mask][last] = (duration, previous) of the shortest path from the depot
+    # visiting every store in mask and finishing at last
+    best = {}
+    frontier = []
+    for p in range(n):
+        if loads[p] <= capacity:
+            best[1 << p] = {p: (fromDepot[p], -1)}
+            frontier.append((1 << p, p, loads[p]))
+    subsets = [mask for mask, highest, load in frontier]
+
+    # Each set is only extended by stores after its highest member so it is built once
+    for size in range(2, maxStops + 1):
+        nextFrontier = []
+        for mask, highest, load in frontier:
+            for q in range(highest + 1, n):
+                newLoad = load + loads[q]
+                if newLoad > capacity:
+                    continue
+
+                newMask = mask | (1 << q)
+                members = [p for p in range(n) if newMask >> p & 1]
+                paths = {}
+                for last in members:
+                    previousPaths = best[newMask ^ (1 << last)]
+                    paths[last] = min(
+                        (previousPaths[prev][0] + between[prev, last], prev)
+                        for prev in previousPaths
+                    )
+                best[newMask] = paths
+                nextFrontier.append((newMask, q, newLoad))
+                subsets.append(newMask)
+        frontier = nextFrontier
+
+    # Closes each set's quickest path back to the depot and recovers the visit order
+    totalDuration = np.empty(len(subsets))
+    stops = np.full((len(subsets), maxStops), -1, dtype=np.intp)
+    for r, mask in enumerate(subsets):
+        paths = best[mask]
+        totalDuration[r], last = min(
+            (paths[last][0] + toDepot[last], last) for last in paths
+        )
+
+        order = []
+        while last != -1:
+            order.append(last)
+            previous = best[mask][last][1]
+            mask ^= 1 << last
+            last = previous
+        stops[r, : len(order)] = [indices[p] for p in reversed(order)]
 
+    return routes_dataframe(durations, totalDuration, stops)
+
+
+@profiler.timed("demand_calculator")
 def demand_calculator(input, demand, weekend):
     """Calculates the demand for inputted routes, taking into account whether
     the route is for a weekday or the weekend
 
     Parameters:
     -----------
-    routes : Panda dataframe
+    routes : Panda dataframe or RoutePool
         Dataframe of pre written routes containing trip duration and stops
     demand : Panda dataframe
         Dataframe containing the demands for each store for both weekdays and weekend
     weekend : Boolean
-        Boolean equalling true if this route is for the weekend
+        Boolean equalling true if this route is for the weekend, if None the demand
+        for both days is calculated (see day_routes)
 
     Returns:
     --------
-    routes : Panda dataframe
+    routes : Panda dataframe or RoutePool
         Dataframe containing the route time length, total demand, and stops visited
+        (if weekend is None the duration is left as travel time and the demand is
+        given in a "Weekday Demand" and a "Saturday Demand" column), or a RoutePool
+        if a RoutePool was given
     """
 
-    routes = input.copy()
+    # Maps each stop to its row of the demand table once, stops left blank (or not in the
+    # table) map to -1, which picks out an extra row of zero demand
+    if isinstance(input, RoutePool):
+        stopIndex = input.store_rows(demand["Store"])
+    else:
+        routes = input.copy()
+        stops = [column for column in routes.columns if column in stopColumns]
+        stopIndex = pd.Index(demand["Store"]).get_indexer(routes[stops].to_numpy().ravel())
+        stopIndex = stopIndex.reshape(len(routes), len(stops))
+    dayDemand = demand[dayDemandColumns].fillna(0).to_numpy(dtype=np.int64)
+    dayDemand = np.vstack((dayDemand, np.zeros((1, len(dayDemandColumns)), dtype=np.int64)))
+
+    # Total demand of each route for both days at once
+    routeDemand = dayDemand[stopIndex].sum(axis=1)
+
+    if isinstance(input, RoutePool):
+        if weekend is None:
+            raise ValueError("a RoutePool holds the demand of one day, give weekend")
+        dayDemand = routeDemand[:, int(weekend)]
+        return RoutePool(
+            input.stops, input.duration + dayDemand * unloadTime, dayDemand, input.stores
+        )
 
-    # Defines shape of arrays
-    rows, cols = routes.shape
-    demandRows, demandCols = demand.shape
+    if weekend is None:
+        for col, column in enumerate(dayDemandColumns):
+            routes.insert(1 + col, column, routeDemand[:, col])
+        return routes
 
-    # Establishes which demand values to use
-    if weekend:
-        demandCol = 1
-    else:
-        demandCol = 0
-
-    # Adds a new "demand" column to the routes dataframe
-    routes.insert(1, "Demand", value=0)
-
-    # Loops through each of the routes adding their demand, and the time taken to unload packages
-    # (which is based off of demand)
-    # Stops searching once the correct demand is found and does not check nans
-    for i in range(0, rows):
-        for j in range(2, cols + 1):
-            currentStore = routes.iloc[i, j]
-            if not pd.isna(currentStore):
-                for k in range(0, demandRows):
-                    if currentStore == demand.iloc[k, 2]:
-                        routes.iloc[i, 1] += demand.iloc[k, demandCol]
-                        routes.iloc[i, 0] += demand.iloc[k, demandCol] * 7.5 * 60
-                        break
+    # Adds the demand, and the time taken to unload packages (which is based off of demand)
+    routes.insert(1, "Demand", routeDemand[:, int(weekend)])
+    routes["Duration"] = routes["Duration"].astype(np.float64) + routes["Demand"] * unloadTime
 
     return routes
 
 
+def day_routes(routes, weekend):
+    """Converts routes with the demand of both days from demand_calculator into
+    the routes for one day, adding the time taken to unload at each stop
+
+    Parameters:
+    -----------
+    routes : Panda dataframe
+        Dataframe of routes with "Weekday Demand" and "Saturday Demand" columns
+    weekend : Boolean
+        Boolean equalling true if the routes are for the weekend
+
+    Returns:
+    --------
+    routes : Panda dataframe
+        Dataframe containing the route time length, total demand, and stops visited
+    """
+    dayRoutes = routes.drop(columns=dayDemandColumns)
+    dayRoutes.insert(1, "Demand", routes[dayDemandColumns[int(weekend)]])
+    dayRoutes["Duration"] = dayRoutes["Duration"] + dayRoutes["Demand"] * unloadTime
+
+    return dayRoutes
+
+
 def filter_routes(input):
     routes = input.copy()
 
@@ -460,84 +799,141 @@ def filter_routes(input):
     return routes
 
 
-if __name__ == "__main__":
+def _init_route_worker(sharedName, shape, stores, depot, demand):
+    """Attaches a worker process to the duration matrix held in shared memory"""
+    global _workerMemory, _workerDurations, _workerDemand
 
-    # Load and separate the data into groups
-    durations, coordinates, demand = load_data()
-    south, east, west = group_coordinates(coordinates)
+    _workerMemory = shared_memory.SharedMemory(name=sharedName)
+    values = np.ndarray(shape, dtype=np.float64, buffer=_workerMemory.buf)
+    values.flags.writeable = False
 
-    test = two_stop_route_generation(durations,south)
-    test2 = two_stop_route_generation(durations,east) 
-    test3 = two_stop_route_generation(durations,west)
-    """
-    # Generate routes in the South sector
-    southRoutesOne = one_stop_route_generation(durations, south)
-    southRoutesTwo = combinatorics_route_generation(durations, south)
-    southRoutesThree = three_stop_route_generation(durations, south, True)
-    southRoutesFour = four_stop_route_generation(durations, south, True)
-    southComplete = pd.concat(
-        [southRoutesOne, southRoutesTwo, southRoutesThree, southRoutesFour],
-        ignore_index=True,
-    )
+    _workerDurations = DurationMatrix(values, stores, depot)
+    _workerDemand = demand
 
-    # Generate routes in the East sector
-    eastRoutesOne = one_stop_route_generation(durations, east)
-    eastRoutesTwo = combinatorics_route_generation(durations, east)
-    eastRoutesThree = three_stop_route_generation(durations, east, True)
-    eastRoutesFour = four_stop_route_generation(durations, east, True)
-    eastComplete = pd.concat(
-        [eastRoutesOne, eastRoutesTwo, eastRoutesThree, eastRoutesFour],
-        ignore_index=True,
-    )
 
-    # Generate routes in the west sector
-    westRoutesOne = one_stop_route_generation(durations, west)
-    westRoutesTwo = combinatorics_route_generation(durations, west)
-    westRoutesThree = three_stop_route_generation(durations, west, True)
-    westRoutesFour = four_stop_route_generation(durations, west, True)
-    westComplete = pd.concat(
-        [westRoutesOne, westRoutesTwo, westRoutesThree, westRoutesFour],
-        ignore_index=True,
-    )
+def _route_job(job, durations=None, demand=None):
+    """Generates the routes for one (sector, isSaturday, numStops) job, where
+    numStops is the largest route length for exhaustive jobs"""
+    if durations is None:
+        durations, demand = _workerDurations, _workerDemand
+    locations, isSaturday, numStops, exhaustive = job
 
-    # Collect routes and factor in demand for both weekday grouping and weekend
-    weekdayRoutes = pd.concat(
-        [southComplete, eastComplete, westComplete], ignore_index=True
+    if exhaustive:
+        return exhaustive_route_generation(
+            durations, locations, demand, numStops, isSaturday
+        )
+    if numStops == 1:
+        return one_stop_route_generation(durations, locations)
+    if numStops == 2:
+        return combinatorics_route_generation(durations, locations)
+
+    openStores = open_store_mask(durations, demand, isSaturday)
+    return nearest_neighbour_route_generation(
+        durations, locations, numStops, True, openStores
     )
 
-    satsouthRoutesThree = three_stop_route_generation(durations, south, True, True)
-    satsouthRoutesFour = four_stop_route_generation(durations, south, True, True)
-    satsouthComplete = pd.concat(
-        [southRoutesOne, southRoutesTwo, satsouthRoutesThree, satsouthRoutesFour],
-        ignore_index=True,
-    )
 
-    sateastRoutesThree = three_stop_route_generation(durations, east, True, True)
-    sateastRoutesFour = four_stop_route_generation(durations, east, True, True)
-    sateastComplete = pd.concat(
-        [eastRoutesOne, eastRoutesTwo, sateastRoutesThree, sateastRoutesFour],
-        ignore_index=True,
-    )
+@profiler.timed("route_generation")
+def generate_all_routes(
+    workers=None, maxStops=4, exhaustive=False, durations=None, coordinates=None, demand=None
+):
+    """Generates, costs and filters the weekday and saturday routes for every sector,
+    running each (sector, day type, stop count) job in a pool of processes
 
-    satwestRoutesThree = three_stop_route_generation(durations, west, True, True)
-    satwestRoutesFour = four_stop_route_generation(durations, west, True, True)
-    satwestComplete = pd.concat(
-        [westRoutesOne, westRoutesTwo, satwestRoutesThree, satwestRoutesFour],
-        ignore_index=True,
-    )
+    The duration matrix is placed in shared memory once and read by every worker
+    rather than being copied to each job. Results are merged in a fixed order so
+    the output does not depend on which job finishes first.
+
+    Parameters:
+    -----------
+    workers : int
+        Number of processes to use, defaults to the number of cpus
+        (if 1 the jobs run in this process)
+    maxStops : int
+        Largest number of stores visited on a route
+    exhaustive : Boolean
+        Boolean equalling true to enumerate every set of stores in a sector with
+        exhaustive_route_generation rather than using nearest neighbour routes
+    durations, coordinates, demand : optional
+        Data as returned by load_data, each one that is not given is loaded from
+        the csv files
+
+    Returns:
+    --------
+    weekdayRoutes : Panda dataframe
+        Dataframe of weekday routes with their duration, demand and stops
+    weekendRoutes : Panda dataframe
+        Dataframe of saturday routes with their duration, demand and stops
+    """
+    if durations is None or coordinates is None or demand is None:
+        loaded = load_data()
+        durations, coordinates, demand = (
+            given if given is not None else default
+            for given, default in zip((durations, coordinates, demand), loaded)
+        )
+    sectors = group_coordinates(coordinates)
+
+    # One and two stop routes do not depend on the day, so are shared by both
+    jobs = []
+    for s in range(len(sectors)):
+        if exhaustive:
+            jobs += [(s, isSaturday, maxStops) for isSaturday in (False, True)]
+        else:
+            jobs += [(s, None, numStops) for numStops in range(1, min(maxStops, 2) + 1)]
+            jobs += [
+                (s, isSaturday, numStops)
+                for isSaturday in (False, True)
+                for numStops in range(3, maxStops + 1)
+            ]
+    tasks = [(sectors[s], bool(isSaturday), numStops, exhaustive) for s, isSaturday, numStops in jobs]
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    if workers == 1:
+        results = [_route_job(task, durations, demand) for task in tasks]
+    else:
+        sharedValues = shared_memory.SharedMemory(create=True, size=durations.values.nbytes)
+        try:
+            np.ndarray(durations.shape, dtype=np.float64, buffer=sharedValues.buf)[:] = durations.values
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_route_worker,
+                initargs=(sharedValues.name, durations.shape, durations.stores, durations.depot, demand),
+            ) as executor:
+                results = list(executor.map(_route_job, tasks))
+        finally:
+            sharedValues.close()
+            sharedValues.unlink()
+
+    # Calculates the demand of both days for every route in one pass
+    results = dict(zip(jobs, results))
+    allRoutes = demand_calculator(pd.concat(results.values(), ignore_index=True), demand, None)
+    starts = np.cumsum([0] + [len(routes) for routes in results.values()])
+    for r, job in enumerate(results):
+        results[job] = allRoutes.iloc[starts[r] : starts[r + 1]]
+
+    # Collects each day's routes in sector then stop count order
+    dayRoutes = []
+    for isSaturday in (False, True):
+        parts = []
+        for s in range(len(sectors)):
+            for (sector, day, numStops), routes in results.items():
+                if sector == s and day in (None, isSaturday):
+                    parts.append(routes)
+        routes = day_routes(pd.concat(parts, ignore_index=True), isSaturday)
+        dayRoutes.append(filter_routes(routes))
+        profiler.count("routes_generated", len(routes))
+        profiler.count("routes_filtered", len(routes) - len(dayRoutes[-1]))
+
+    return dayRoutes[0], dayRoutes[1]
 
-    weekendRoutes = pd.concat(
-        [satsouthComplete, sateastComplete, satwestComplete], ignore_index=True
-    )
 
-    weekdayRoutes = demand_calculator(weekdayRoutes, demand, False)
-    weekendRoutes = demand_calculator(weekendRoutes, demand, True)
+if __name__ == "__main__":
 
-    # Remove routes with demands over 26
-    weekdayRoutes = filter_routes(weekdayRoutes)
-    weekendRoutes = filter_routes(weekendRoutes)
+    # Generate and cost the routes of every sector for weekdays and saturdays
+    weekdayRoutes, weekendRoutes = generate_all_routes()
 
     # Save the routes as csv files (if any values are blank they will show as NaN)
     weekdayRoutes.to_csv("Weekday_Routes.csv", index=False)
     weekendRoutes.to_csv("Weekend_Routes.csv", index=False)
-    """
\ No newline at end of file
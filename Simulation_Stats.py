@@ -0,0 +1,178 @@
+import numpy as np
+import scipy.stats as st
+
+
+class CostAccumulator:
+    """Running summary of simulated costs that keeps a fixed amount of memory however
+    many costs are added
+
+    The count, mean and sum of squared deviations are updated with Welford's method
+    (combined between batches with Chan's formula), alongside the minimum, maximum
+    and a histogram over fixed bins. The histogram doubles as a quantile sketch:
+    quantiles are interpolated within its bins, so are accurate to a bin width.
+    Accumulators with the same bins can be merged, so chunks of simulations can be
+    summarised separately and then combined.
+
+    Parameters:
+    -----------
+    binEdges : 1d Array
+        Edges of the histogram bins, costs outside them are counted below or above
+    """
+
+    def __init__(self, binEdges):
+        self.binEdges = np.asarray(binEdges, dtype=np.float64)
+        self.counts = np.zeros(len(self.binEdges) + 1, dtype=np.int64)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, costs):
+        """Adds a batch of costs to the summary"""
+        costs = np.asarray(costs, dtype=np.float64)
+        if len(costs) == 0:
+            return
+
+        batch = CostAccumulator(self.binEdges)
+        batch.count = len(costs)
+        batch.mean = costs.mean()
+        batch.m2 = ((costs - batch.mean) ** 2).sum()
+        batch.min = costs.min()
+        batch.max = costs.max()
+        batch.counts = np.bincount(
+            np.searchsorted(self.binEdges, costs, side="right"),
+            minlength=len(self.counts),
+        )
+        self.merge(batch)
+
+    def merge(self, other):
+        """Combines the summary of other into this one"""
+        if not np.array_equal(self.binEdges, other.binEdges):
+            raise ValueError("only accumulators with the same bins can be merged")
+        if other.count == 0:
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.counts += other.counts
+
+    @property
+    def variance(self):
+        """Sample variance of the costs"""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def sem(self):
+        """Standard error of the mean cost"""
+        return np.sqrt(self.variance / self.count)
+
+    def interval(self, confidence=0.95):
+        """Normal confidence interval for the mean cost"""
+        return st.norm.interval(confidence, loc=self.mean, scale=self.sem)
+
+    def quantile(self, q):
+        """Estimates the q quantile of the costs from the histogram"""
+        # bins with the costs below the first edge and above the last edge are
+        # bounded by the minimum and maximum
+        edges = np.concatenate(([self.min], self.binEdges, [self.max]))
+        edges = np.clip(edges, self.min, self.max)
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+
+        return np.interp(q * self.count, cumulative, edges)
+
+    def summary(self):
+        """Dictionary of the count, minimum, mean, maximum, standard deviation and
+        5%, 50% and 95% quantiles of the costs"""
+        return {
+            "count": self.count,
+            "min": self.min,
+            "mean": self.mean,
+            "max": self.max,
+            "std": np.sqrt(self.variance),
+            "q05": self.quantile(0.05),
+            "q50": self.quantile(0.5),
+            "q95": self.quantile(0.95),
+        }
+
+
+def default_bins(costs, numBins=1000):
+    """Returns histogram bin edges spanning twice the range of a first batch of costs
+
+    Parameters:
+    -----------
+    costs : 1d Array
+        Costs from a first batch of simulations
+    numBins : int
+        Number of bins
+
+    Returns:
+    --------
+    binEdges : 1d Array
+        Edges of the bins
+    """
+    span = max(costs.max() - costs.min(), 1.0)
+
+    return np.linspace(costs.min() - span / 2, costs.max() + span / 2, numBins + 1)
+
+
+def run_to_precision(
+    simulateBatch,
+    tolerance=None,
+    relTolerance=None,
+    confidence=0.95,
+    batchSize=1000,
+    maxSimulations=1000000,
+):
+    """Runs batches of simulations until the confidence interval of the mean cost is
+    narrow enough
+
+    After each batch the running mean and variance are updated, and the simulations
+    stop once the half-width of the confidence interval is at most tolerance dollars
+    or relTolerance times the mean, whichever is larger.
+
+    Parameters:
+    -----------
+    simulateBatch : function
+        Function taking a number of simulations and returning an array of their costs
+    tolerance : float
+        Largest half-width of the confidence interval in dollars
+    relTolerance : float
+        Largest half-width of the confidence interval as a fraction of the mean
+    confidence : float
+        Confidence level of the interval
+    batchSize : int
+        Number of simulations in each batch
+    maxSimulations : int
+        Most simulations run if the precision is not reached
+
+    Returns:
+    --------
+    accumulator : CostAccumulator
+        Summary of the costs, where accumulator.count is the number of simulations run
+    converged : Boolean
+        Boolean equalling true if the precision was reached
+    """
+    if tolerance is None and relTolerance is None:
+        raise ValueError("give a tolerance or relTolerance to run to")
+
+    z = st.norm.ppf(0.5 + confidence / 2)
+    firstCosts = simulateBatch(min(batchSize, maxSimulations))
+    accumulator = CostAccumulator(default_bins(firstCosts))
+    accumulator.add(firstCosts)
+
+    while True:
+        target = max(tolerance or 0.0, (relTolerance or 0.0) * abs(accumulator.mean))
+        if accumulator.count > 1 and z * accumulator.sem <= target:
+            return accumulator, True
+        if accumulator.count >= maxSimulations:
+            return accumulator, False
+
+        accumulator.add(
+            simulateBatch(min(batchSize, maxSimulations - accumulator.count))
+        )
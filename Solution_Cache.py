@@ -0,0 +1,154 @@
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from Route_Generation import RoutePool
+
+# Directory the solutions are stored in
+cacheDir = ".solution_cache"
+
+
+def solution_key(routeData, storeLocations, storeDemand, isSaturday, maxTrucks, rates):
+    """Returns a hash of everything a routing model's solution depends on
+
+    Parameters:
+    -----------
+    routeData : Pandas Dataframe or RoutePool
+        Df of route info from route generation
+    storeLocations : Pandas Dataframe
+        Df of every store name
+    storeDemand : 1d Array
+        demand of each store in storeLocations on the day
+    isSaturday : Boolean
+        true if the deliveries are for a saturday
+    maxTrucks : Int
+        number of routes that can be chosen
+    rates : Dict
+        rates used to cost the routes
+
+    Returns:
+    --------
+    key : String
+        Hex digest identifying the model
+    """
+    digest = hashlib.sha256()
+    if isinstance(routeData, RoutePool):
+        for array in routeData.to_arrays().values():
+            digest.update(array.tobytes())
+    else:
+        digest.update(repr(list(routeData.columns)).encode())
+        digest.update(
+            pd.util.hash_pandas_object(routeData, index=False).to_numpy().tobytes()
+        )
+    digest.update(
+        pd.util.hash_pandas_object(storeLocations["Store"], index=False)
+        .to_numpy()
+        .tobytes()
+    )
+    digest.update(np.ascontiguousarray(storeDemand, dtype=np.float64).tobytes())
+    digest.update(repr((bool(isSaturday), maxTrucks, sorted(rates.items()))).encode())
+
+    return digest.hexdigest()
+
+
+class SolutionCache:
+    """Least recently used cache of solved routing models, held in memory and on disk.
+
+    Each solution is kept as its status, objective and the numbers of its chosen
+    routes, in memory for this process and in an npz file so that it is also reused
+    by later runs. When either holds more than its limit of solutions the least
+    recently used ones are dropped.
+
+    Parameters:
+    -----------
+    directory : String
+        directory for the solution files, or None to only keep them in memory
+    maxMemory : Int
+        most solutions kept in memory
+    maxDisk : Int
+        most solution files kept in directory
+    """
+
+    def __init__(self, directory=cacheDir, maxMemory=32, maxDisk=256):
+        self.directory = directory
+        self.maxMemory = maxMemory
+        self.maxDisk = maxDisk
+        self.memory = OrderedDict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """Returns the (status, objective, chosen route numbers) stored for key, or None"""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.directory is None:
+            return None
+
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                entry = (str(data["status"]), float(data["objective"]), data["routes"])
+            # marks the file as recently used
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, status, objective, routes):
+        """Stores the status, objective and chosen route numbers of a solution"""
+        entry = (status, float(objective), np.asarray(routes, dtype=np.int64))
+        self._remember(key, entry)
+        if self.directory is None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        file, tempPath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(file, "wb") as handle:
+                np.savez(handle, status=entry[0], objective=entry[1], routes=entry[2])
+            os.replace(tempPath, self._path(key))
+        except BaseException:
+            os.remove(tempPath)
+            raise
+
+        # drops the least recently used files over the limit
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                path = os.path.join(self.directory, name)
+                try:
+                    files.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+        files.sort()
+        for _, path in files[: max(len(files) - self.maxDisk, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Removes every solution from memory and disk"""
+        self.memory.clear()
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxMemory:
+            self.memory.popitem(last=False)
+
+
+# Cache shared by every call to Woolworths_LP.solve_lp
+solutionCache = SolutionCache()
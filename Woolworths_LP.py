@@ -1,18 +1,53 @@
+import copy
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
 import numpy as np
-from numpy.core.numeric import NaN
 import pandas as pd
 from pulp import *
+from scipy import sparse
+
+import Route_Cache
+import Route_Generation
+from Pipeline_Profiling import profiler
+from Solution_Cache import solution_key, solutionCache
 
 np.set_printoptions(threshold=sys.maxsize)
 pd.set_option("display.max_rows", None)
 
+# Rates used to cost a route: $225 an hour, $275 an hour (in total, not on top of the
+# $225) after the first 4 hours and $2000 to wet lease a truck for a route with more
+# demand than a truck can carry
+costRates = {
+    "hourlyRate": 225,
+    "overtimeRate": 275,
+    "shiftLength": 4 * 60 * 60,
+    "wetLeaseCost": 2000,
+    "truckCapacity": 26,
+}
+
+# Number of trucks available each day
+maxTrucks = 60
+
+# Route variables within this of 1 are chosen, as solvers only meet integrality to a tolerance
+integralityTolerance = 1e-6
 
-def load_data():
+
+@profiler.timed("load")
+def load_data(useCache=True):
     """Returns route info from route generation in pandas dataframes.
 
     Parameters:
     -----------
-    none
+    useCache : Boolean
+        Boolean equalling true to load the routes from the route cache, generating
+        them if the input files have changed, rather than from the route csv files
 
     Returns:
     --------
@@ -26,79 +61,748 @@ def load_data():
 
     """
     # Read file and convert into panda dataframe
-    Weekday_Routes = pd.read_csv("Weekday_Routes.csv")
-    Weekend_Routes = pd.read_csv("Weekend_Routes.csv")
+    if useCache:
+        Weekday_Routes, Weekend_Routes = Route_Cache.cached_routes()
+    else:
+        Weekday_Routes = pd.read_csv("Weekday_Routes.csv")
+        Weekend_Routes = pd.read_csv("Weekend_Routes.csv")
     storeLocations = pd.read_csv("WoolworthsDemands.csv", usecols=[0])
     return Weekday_Routes, Weekend_Routes, storeLocations
 
 
+@profiler.timed("column_generation")
 def column_generation(routeData, storeLocations):
     """Returns a matrix for constructing route location constraints in the LP.
 
     Parameters:
     -----------
-    none
+    routeData : Pandas Dataframe or RoutePool
+        Df of route info from route generation
+    storeLocations : Pandas Dataframe
+        Df of every store name
 
     Returns:
     --------
-    routeVisits : 2d Array
-        matrix where the rows are store locations and the columns are the routes. The matrix value is 1 if the route passes through
+    routeVisits : scipy.sparse csc_matrix
+        sparse matrix where the rows are store locations and the columns are the routes. The matrix value is 1 if the route passes through
         the location and 0 if not.
     """
-    # this reads demand by weekday, removes the distribution centre and sorts it to be the same order as storeLocations
-    # demand_check = pd.read_csv("Demand by weekday.csv").drop(55, axis=0).sort_values("Store").reset_index(drop=True)
-
-    firstStops = routeData.to_dict()["First Stop"]
-    secondStops = routeData.to_dict()["Second Stop"]
-    thirdStops = routeData.to_dict()["Third Stop"]
-    fourthStops = routeData.to_dict()["Fourth Stop"]
-    storeLocationDict = storeLocations.to_dict()["Store"]
-    routeVisits = np.zeros((len(storeLocations), len(firstStops)))
-
-    for i in range(len(firstStops)):
-        # pulls the location number from a route number
-        if pd.isna(firstStops[i]) is False:
-            locationNumber = list(storeLocationDict.keys())[
-                list(storeLocationDict.values()).index(firstStops[i])
-            ]
-            routeVisits[locationNumber][i] = 1
-
-    for i in range(len(secondStops)):
-        # pulls the location number from a route number
-        if pd.isna(secondStops[i]) is False:
-            locationNumber = list(storeLocationDict.keys())[
-                list(storeLocationDict.values()).index(secondStops[i])
-            ]
-            routeVisits[locationNumber][i] = 1
-
-    for i in range(len(thirdStops)):
-        # pulls the location number from a route number
-        if pd.isna(thirdStops[i]) is False:
-            locationNumber = list(storeLocationDict.keys())[
-                list(storeLocationDict.values()).index(thirdStops[i])
-            ]
-            routeVisits[locationNumber][i] = 1
-
-    for i in range(len(fourthStops)):
-        # pulls the location number from a route number
-        if pd.isna(fourthStops[i]) is False:
-            locationNumber = list(storeLocationDict.keys())[
-                list(storeLocationDict.values()).index(fourthStops[i])
-            ]
-            routeVisits[locationNumber][i] = 1
+    numRoutes = len(routeData)
+
+    # codes every stop of every route (row by row) by its store, blank stops get the code -1
+    if isinstance(routeData, Route_Generation.RoutePool):
+        codes, stopNames = routeData.stops.ravel(), routeData.stores
+        numStops = routeData.stops.shape[1]
+    else:
+        stops = [
+            column
+            for column in routeData.columns
+            if column in Route_Generation.stopColumns
+        ]
+        codes, stopNames = pd.factorize(routeData[stops].to_numpy().ravel())
+        numStops = len(stops)
+    storeRows = pd.Index(storeLocations["Store"]).get_indexer(stopNames)
+
+    # pulls the location number and route number of each stop that is visited
+    visited = codes != -1
+    locationNumbers = storeRows[codes[visited]]
+    if (locationNumbers == -1).any():
+        unknown = np.unique(
+            np.asarray(stopNames)[codes[visited][locationNumbers == -1]]
+        )
+        raise ValueError(
+            "routes visit stores not in storeLocations: " + ", ".join(unknown)
+        )
+    routeNumbers = np.repeat(np.arange(numRoutes), numStops)[visited]
+
+    routeVisits = sparse.csc_matrix(
+        (np.ones(len(locationNumbers)), (locationNumbers, routeNumbers)),
+        shape=(len(storeLocations), numRoutes),
+    )
 
     return routeVisits
 
 
-def solve_lp(routeData, storeLocations, isSaturday=False):
-    """Solves the mixed integer programme given routeData and .
+def duration_costs(durations, rates=None):
+    """Returns the cost of paying for trucks to drive routes of the given lengths.
+
+    Every route and simulation costs time with this, so the LP and the simulations
+    agree. Hours up to the shift length cost the hourly rate and each hour after it
+    costs the overtime rate in total, rather than the overtime rate on top of the
+    hourly rate.
+
+    Parameters:
+    -----------
+    durations : Array
+        duration of each route in seconds, of any shape
+    rates : Dict
+        hourly rates and shift length, costRates if not given
+
+    Returns:
+    --------
+    costs : Array
+        cost of each duration, in the same shape as durations
+    """
+    if rates is None:
+        rates = costRates
+    durations = np.asarray(durations, dtype=np.float64)
+
+    costs = durations * (rates["hourlyRate"] / 3600)
+    costs += (
+        np.maximum(durations - rates["shiftLength"], 0)
+        * (rates["overtimeRate"] - rates["hourlyRate"])
+        / 3600
+    )
+
+    return costs
+
+
+def route_costs(routeData, rates=None):
+    """Returns the cost of each route from its duration and demand.
+
+    Parameters:
+    -----------
+    routeData : Pandas Dataframe or RoutePool
+        Df of route info from route generation
+    rates : Dict
+        hourly rates, shift length, wet lease cost and truck capacity, costRates if not given
+
+    Returns:
+    --------
+    costs : 1d Array
+        cost of each route: $225 an hour, $275 an hour over 4 hours
+        and $2000 for routes with more demand than a truck can carry
+    """
+    if rates is None:
+        rates = costRates
+    if isinstance(routeData, Route_Generation.RoutePool):
+        durations = routeData.duration.astype(np.float64)
+        demands = routeData.demand
+    else:
+        durations = routeData["Duration"].to_numpy(dtype=np.float64)
+        demands = routeData["Demand"].to_numpy()
+
+    # cost of the time taken, then the cost of going over demand per route
+    costs = duration_costs(durations, rates)
+    costs += np.where(demands > rates["truckCapacity"], rates["wetLeaseCost"], 0)
+
+    return costs
+
+
+def day_demand(storeLocations, isSaturday=False, demandFile="Demand by weekday.csv"):
+    """Returns the demand of each store on the day.
+
+    Parameters:
+    -----------
+    storeLocations : Pandas Dataframe
+        Df of every store name
+    isSaturday : Boolean
+        true if the deliveries are for a saturday
+    demandFile : String
+        csv file of the weekday and saturday demand of each store
+
+    Returns:
+    --------
+    storeDemand : 1d Array
+        demand of each store in storeLocations, 0 for stores not in the file
+    """
+    # this reads demand by weekday and puts it in the same order as storeLocations
+    demand = pd.read_csv(demandFile).set_index("Store").reindex(storeLocations["Store"])
+
+    return demand.iloc[:, int(isSaturday)].fillna(0).to_numpy()
+
+
+def covered_stores(
+    storeLocations, isSaturday=False, demandFile="Demand by weekday.csv"
+):
+    """Returns the rows of storeLocations for the stores that need a delivery.
+
+    Parameters:
+    -----------
+    storeLocations : Pandas Dataframe
+        Df of every store name
+    isSaturday : Boolean
+        true if the deliveries are for a saturday
+    demandFile : String
+        csv file of the weekday and saturday demand of each store
+
+    Returns:
+    --------
+    coverRows : 1d Array
+        row numbers of the stores with nonzero demand on the day
+    """
+    storeDemand = day_demand(storeLocations, isSaturday, demandFile)
+
+    return np.flatnonzero(storeDemand != 0)
+
+
+@profiler.timed("model_build")
+def build_model(
+    costs, routeVisits, coverRows, maxTrucks=maxTrucks, relax=False, artificialCost=None
+):
+    """Builds the set partitioning model of choosing routes so each store is visited once.
+
+    The constraints are built straight from the nonzeros of routeVisits, so each one
+    only holds the routes that visit its store.
+
+    Parameters:
+    -----------
+    costs : 1d Array
+        cost of each route
+    routeVisits : scipy.sparse matrix
+        matrix where the rows are store locations and the columns are the routes
+    coverRows : 1d Array
+        rows of the stores that must be visited
+    maxTrucks : Int
+        number of routes that can be chosen
+    relax : Boolean
+        true to build the LP relaxation, with route variables between 0 and 1
+    artificialCost : Float
+        if given, each store constraint also gets an artificial variable with this cost
+        that visits the store without a truck, so the model is always feasible
+
+    Returns:
+    --------
+    prob : LpProblem
+        the model
+    routeVars : List
+        the variable of each route, named route_<column number>
+    coverConstraints : Dict
+        the constraint of each store row in coverRows, named store_<row number>
+    """
+    numRoutes = routeVisits.shape[1]
+    visits = sparse.csr_matrix(routeVisits)
+
+    # create prob variable object for problem data
+    prob = LpProblem("Routes", LpMinimize)
+
+    # route variables
+    if relax:
+        routeVars = [LpVariable(f"route_{b}", 0, 1) for b in range(numRoutes)]
+    else:
+        routeVars = [
+            LpVariable(f"route_{b}", 0, None, cat="Binary") for b in range(numRoutes)
+        ]
+
+    # input the obj function into prob using the costs for each route
+    objective = LpAffineExpression(zip(routeVars, np.asarray(costs).tolist()))
+    prob += (objective, "Objective cost function")
+
+    # constraint: each store is visited once, by the routes in its row of the matrix
+    coverConstraints = {}
+    for i in coverRows:
+        start, end = visits.indptr[i], visits.indptr[i + 1]
+        visitors = LpAffineExpression(
+            zip(
+                [routeVars[b] for b in visits.indices[start:end]],
+                visits.data[start:end].tolist(),
+            )
+        )
+        if artificialCost is not None:
+            artificial = LpVariable(f"artificial_{i}", 0)
+            visitors[artificial] = 1
+            objective[artificial] = artificialCost
+        coverConstraints[i] = LpConstraint(visitors, LpConstraintEQ, f"store_{i}", 1)
+        prob += coverConstraints[i]
+
+    # constraint: Trucks
+    prob += LpConstraint(
+        LpAffineExpression((v, 1) for v in routeVars),
+        LpConstraintLE,
+        "trucks",
+        maxTrucks,
+    )
+
+    coverRows = np.asarray(coverRows, dtype=np.intp)
+    profiler.count("lp_rows", len(coverRows) + 1)
+    profiler.count("lp_columns", numRoutes)
+    profiler.count(
+        "lp_nonzeros",
+        int((visits.indptr[coverRows + 1] - visits.indptr[coverRows]).sum())
+        + numRoutes,
+    )
+
+    return prob, routeVars, coverConstraints
+
+
+class RouteSolution:
+    """A solved routing model, kept so that scenarios can be re-solved from it.
+
+    Parameters:
+    -----------
+    status : String
+        status of the problem, should be optimal
+    objective : Float
+        value of the minimised cost
+    routeData : Pandas DataFrame or RoutePool
+        Df of every route in the model
+    storeLocations : Pandas Dataframe
+        Df of every store name
+    routeVisits : scipy.sparse matrix
+        matrix where the rows are store locations and the columns are the routes
+    coverRows : 1d Array
+        rows of the stores that must be visited
+    selected : 1d Array
+        true for each route in the plan the solver found, all false if it found no
+        integer solution (e.g. when it was stopped by its time limit first)
+    isSaturday : Boolean
+        true if the deliveries are for a saturday
+    modelFile : String
+        file the model was written to, None if it was not written
+    stats : Dict
+        statistics of the solve from SolverConfig.solve
+    values : 1d Array
+        value of each route variable
+    duals : 1d Array
+        dual value of each store's constraint, NaN for stores without one
+    truckDual : Float
+        dual value of the truck constraint
+    reducedCosts : 1d Array
+        reduced cost of each route variable
+    """
+
+    def __init__(
+        self,
+        status,
+        objective,
+        routeData,
+        storeLocations,
+        routeVisits,
+        coverRows,
+        selected,
+        isSaturday,
+        modelFile=None,
+        stats=None,
+        values=None,
+        duals=None,
+        truckDual=None,
+        reducedCosts=None,
+    ):
+        self.status = status
+        self.objective = objective
+        self.routeData = routeData
+        self.storeLocations = storeLocations
+        self.routeVisits = routeVisits
+        self.coverRows = coverRows
+        self.selected = selected
+        self.isSaturday = isSaturday
+        self.modelFile = modelFile
+        self.stats = stats
+        self.values = values
+        self.duals = duals
+        self.truckDual = truckDual
+        self.reducedCosts = reducedCosts
+
+    @property
+    def routes(self):
+        """Data frame (or RoutePool, if the model was built from one) with all the
+        route info of the chosen routes"""
+        return self.routeData.take(np.flatnonzero(self.selected))
+
+    @property
+    def routePool(self):
+        """RoutePool of the chosen routes"""
+        routes = self.routes
+        if isinstance(routes, Route_Generation.RoutePool):
+            return routes
+        return Route_Generation.RoutePool.from_dataframe(routes)
+
+
+def model_results(prob, routeVars, coverConstraints, numStores):
+    """Reads the solution of a solved model as arrays in route and store order.
+
+    Parameters:
+    -----------
+    prob : LpProblem
+        the solved model
+    routeVars : List
+        the variable of each route, from build_model
+    coverConstraints : Dict
+        the constraint of each store row, from build_model
+    numStores : Int
+        number of rows in storeLocations
+
+    Returns:
+    --------
+    values : 1d Array
+        value of each route variable, NaN if the solver gave none
+    duals : 1d Array
+        dual value of each store's constraint, NaN for stores without one
+    truckDual : Float
+        dual value of the truck constraint
+    reducedCosts : 1d Array
+        reduced cost of each route variable
+    """
+    values = np.array([v.varValue for v in routeVars], dtype=np.float64)
+    reducedCosts = np.array([v.dj for v in routeVars], dtype=np.float64)
+
+    duals = np.full(numStores, np.nan)
+    rows = np.fromiter(coverConstraints, dtype=np.intp, count=len(coverConstraints))
+    duals[rows] = np.array(
+        [constraint.pi for constraint in coverConstraints.values()], dtype=np.float64
+    )
+    truckDual = prob.constraints["trucks"].pi
+
+    return values, duals, np.nan if truckDual is None else truckDual, reducedCosts
+
+
+def write_model(prob, modelFile):
+    """Writes the model to a file in the format given by the file's extension.
+
+    Parameters:
+    -----------
+    prob : LpProblem
+        the model
+    modelFile : String
+        path ending in .lp, .mps or .mps.gz (gzip compressed mps), or just one of
+        those extensions to write to a new temporary file, so calls running at the
+        same time do not overwrite each other's files
+
+    Returns:
+    --------
+    modelFile : String
+        path the model was written to
+    """
+    if not modelFile.endswith((".lp", ".mps", ".mps.gz")):
+        raise ValueError("model files must end in .lp, .mps or .mps.gz")
+    if modelFile in (".lp", ".mps", ".mps.gz"):
+        handle, modelFile = tempfile.mkstemp(prefix="Routes_", suffix=modelFile)
+        os.close(handle)
+
+    if modelFile.endswith(".lp"):
+        prob.writeLP(modelFile)
+    elif modelFile.endswith(".mps"):
+        prob.writeMPS(modelFile)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            mpsFile = os.path.join(directory, "Routes.mps")
+            prob.writeMPS(mpsFile)
+            with open(mpsFile, "rb") as source, gzip.open(modelFile, "wb") as target:
+                shutil.copyfileobj(source, target)
+
+    return modelFile
+
+
+class SolverConfig:
+    """Settings of the solver used for the routing models.
+
+    Parameters:
+    -----------
+    backend : String
+        "cbc", "highs" (needs highspy, and is passed the model in memory) or "auto"
+        to use HiGHS if highspy is installed and CBC if not, or if the solve has a
+        MIP start
+    threads : Int
+        number of threads the solver uses, the solver's default if None
+    timeLimit : Float
+        seconds after which the solver stops searching and returns the best plan
+        found so far, if any. This does not bound the time a solve takes, CBC only
+        checks it at some points and can run well past it (e.g. while presolving),
+        and a stopped solve may have no plan or one that is not optimal, see the
+        solutionStatus of the solve's statistics
+    gapRel : Float
+        relative gap between the plan and the lower bound at which the solver stops
+    warmStart : 1d Array
+        starting value of each route variable, passed to the solver as a MIP start
+        (only CBC uses it, the highs backend warns that it is ignored)
+    msg : Boolean
+        true to print the solver's log
+    tmpDir : String
+        directory for CBC's model, solution and log files, the system's temporary
+        directory if None
+    """
+
+    def __init__(
+        self,
+        backend="auto",
+        threads=None,
+        timeLimit=None,
+        gapRel=None,
+        warmStart=None,
+        msg=False,
+        tmpDir=None,
+    ):
+        if backend not in ("auto", "cbc", "highs"):
+            raise ValueError('backend must be "auto", "cbc" or "highs"')
+        self.backend = backend
+        self.threads = threads
+        self.timeLimit = timeLimit
+        self.gapRel = gapRel
+        self.warmStart = warmStart
+        self.msg = msg
+        self.tmpDir = tmpDir
+
+    def solve(self, prob, warmStart=False):
+        """Solves prob, returning statistics of the solve.
+
+        Parameters:
+        -----------
+        prob : LpProblem
+            the model
+        warmStart : Boolean
+            true to pass the initial values of the variables as a MIP start
+
+        Returns:
+        --------
+        stats : Dict
+            backend used, seconds of wall time, solutionStatus (the LpSolution name
+            of prob.sol_status, which tells a proven optimal plan from one found
+            before the solver stopped and from no plan at all), nodes explored,
+            relative gap and simplex iterations (None where the solver does not
+            report them)
+        """
+        highs = HiGHS(
+            msg=self.msg,
+            timeLimit=self.timeLimit,
+            gapRel=self.gapRel,
+            threads=self.threads,
+        )
+        if self.backend == "highs" and not highs.available():
+            raise PulpSolverError("the highs backend needs highspy to be installed")
+
+        # HiGHS is not given MIP starts, so auto keeps them by solving with CBC
+        useHighs = self.backend == "highs" or (
+            self.backend == "auto" and highs.available() and not warmStart
+        )
+        if useHighs and warmStart:
+            warnings.warn("the highs backend ignores the MIP start, solving cold")
+
+        start = perf_counter()
+        if useHighs:
+            prob.solve(highs)
+            stats = {
+                "backend": "highs",
+                "seconds": perf_counter() - start,
+                "solutionStatus": LpSolution[prob.sol_status],
+            }
+            stats.update(highs_stats(prob.solverModel))
+            return stats
+
+        # CBC's log is always kept, to read the statistics from
+        handle, logPath = tempfile.mkstemp(
+            prefix="Routes_", suffix=".log", dir=self.tmpDir
+        )
+        os.close(handle)
+        try:
+            cbc = PULP_CBC_CMD(
+                msg=False,
+                timeLimit=self.timeLimit,
+                gapRel=self.gapRel,
+                threads=self.threads,
+                warmStart=warmStart,
+                logPath=logPath,
+            )
+            if self.tmpDir is not None:
+                cbc.tmpDir = self.tmpDir
+            prob.solve(cbc)
+            seconds = perf_counter() - start
+            with open(logPath) as file:
+                cbcLog = file.read()
+        finally:
+            os.remove(logPath)
+
+        if self.msg:
+            print(cbcLog)
+        stats = {
+            "backend": "cbc",
+            "seconds": seconds,
+            "solutionStatus": LpSolution[prob.sol_status],
+        }
+        stats.update(cbc_stats(cbcLog))
+        return stats
+
+
+def cbc_stats(cbcLog):
+    """Reads the nodes, gap and iterations of a solve from CBC's log.
 
     Parameters:
     -----------
-    routeData : Pandas Dataframe
+    cbcLog : String
+        text CBC printed while solving
+
+    Returns:
+    --------
+    stats : Dict
+        nodes explored, relative gap and simplex iterations, None if not in the log
+    """
+
+    def number(pattern, kind):
+        match = re.search(pattern, cbcLog)
+        return kind(match.group(1)) if match else None
+
+    # the bound is only printed if the search stopped early, and the gap CBC prints
+    # is rounded to 2 decimal places, so it is worked out from the bound
+    objective = number(r"(?m)^Objective value:\s+(\S+)", float)
+    lowerBound = number(r"(?m)^Lower bound:\s+(\S+)", float)
+    gap = None
+    if objective and lowerBound is not None:
+        gap = max(objective - lowerBound, 0) / abs(objective)
+    elif re.search(r"(?m)^Result - Optimal solution found$", cbcLog):
+        gap = 0.0
+
+    return {
+        "nodes": number(r"Enumerated nodes:\s+(\d+)", int),
+        "gap": gap,
+        "iterations": number(r"Total iterations:\s+(\d+)", int),
+    }
+
+
+def highs_stats(highs):
+    """Reads the nodes, gap and iterations of a solve from a highspy.Highs model"""
+    try:
+        info = highs.getInfo()
+        return {
+            "nodes": int(info.mip_node_count),
+            "gap": float(info.mip_gap),
+            "iterations": int(info.simplex_iteration_count),
+        }
+    except AttributeError:
+        return {"nodes": None, "gap": None, "iterations": None}
+
+
+# Solver settings used when none are given
+defaultSolver = SolverConfig()
+
+
+def solve_route_model(
+    routeData,
+    storeLocations,
+    isSaturday=False,
+    routeVisits=None,
+    coverRows=None,
+    warmStart=None,
+    maxTrucks=maxTrucks,
+    rates=None,
+    solver=None,
+    writeModel=None,
+):
+    """Solves the mixed integer programme given routeData, keeping the model data.
+
+    Parameters:
+    -----------
+    routeData : Pandas Dataframe or RoutePool
         Df of route info from route generation
     storeLocations : Pandas Dataframe
         Df of every store name and coordinates
+    isSaturday : Boolean
+        true if the deliveries are for a saturday
+    routeVisits : scipy.sparse matrix
+        matrix of which routes visit which stores, built from routeData if not given
+    coverRows : 1d Array
+        rows of the stores that must be visited, read from the demand if not given
+    warmStart : 1d Array
+        starting value of each route variable, passed to the solver as a MIP start,
+        the solver's warmStart if not given
+    maxTrucks : Int
+        number of routes that can be chosen
+    rates : Dict
+        rates used to cost the routes, costRates if not given
+    solver : SolverConfig
+        settings of the solver, defaultSolver if not given
+    writeModel : String
+        file to write the model to before solving, see write_model, or None to not
+        write it (the solver does not need it)
+
+    Returns:
+    --------
+    solution : RouteSolution
+        the solved model
+    """
+    # create the matrix of which routes visit which locations, and find the stores to visit
+    if routeVisits is None:
+        routeVisits = column_generation(routeData, storeLocations)
+    if coverRows is None:
+        coverRows = covered_stores(storeLocations, isSaturday)
+
+    if solver is None:
+        solver = defaultSolver
+    if warmStart is None:
+        warmStart = solver.warmStart
+
+    prob, routeVars, coverConstraints = build_model(
+        route_costs(routeData, rates), routeVisits, coverRows, maxTrucks
+    )
+    if warmStart is not None:
+        for v, start in zip(routeVars, warmStart):
+            v.setInitialValue(start)
+
+    ##SOLVING ROUTINES##
+    modelFile = None
+    if writeModel is not None:
+        with profiler.stage("write_model"):
+            modelFile = write_model(prob, writeModel)
+    with profiler.stage("solve"):
+        stats = solver.solve(prob, warmStart is not None)
+
+    # the routes chosen by the solver, in the same order as routeData, none if the
+    # solver stopped or failed without an integer solution
+    values, duals, truckDual, reducedCosts = model_results(
+        prob, routeVars, coverConstraints, len(storeLocations)
+    )
+    if prob.sol_status in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+        selected = values > 1 - integralityTolerance
+    else:
+        selected = np.zeros(len(values), dtype=bool)
+
+    return RouteSolution(
+        LpStatus[prob.status],
+        value(prob.objective),
+        routeData,
+        storeLocations,
+        routeVisits,
+        coverRows,
+        selected,
+        isSaturday,
+        modelFile,
+        stats,
+        values,
+        duals,
+        truckDual,
+        reducedCosts,
+    )
+
+
+def solve_lp(
+    routeData,
+    storeLocations,
+    isSaturday=False,
+    maxTrucks=maxTrucks,
+    rates=None,
+    cache=solutionCache,
+    writeModel=None,
+    solver=None,
+    stats=False,
+    closedStores=(),
+):
+    """Solves the mixed integer programme given routeData and storeLocations.
+
+    Solutions proven optimal are kept in cache, keyed by a hash of the routes, stores,
+    demand, truck limit and cost rates, so solving the same model again returns them
+    at once.
+
+    Parameters:
+    -----------
+    routeData : Pandas Dataframe or RoutePool
+        Df of route info from route generation
+    storeLocations : Pandas Dataframe
+        Df of every store name and coordinates
+    isSaturday : Boolean
+        true if the deliveries are for a saturday
+    maxTrucks : Int
+        number of routes that can be chosen
+    rates : Dict
+        rates used to cost the routes, costRates if not given
+    cache : SolutionCache
+        cache of solutions to reuse, or None to always solve the model
+    writeModel : String
+        file to write the model to when it is solved, see write_model
+    solver : SolverConfig
+        settings of the solver, defaultSolver if not given
+    stats : Boolean
+        true to also return the statistics of the solve
+    closedStores : List
+        names of stores that are closed, they are not visited and every route that
+        visits them is dropped
 
     Returns:
     --------
@@ -108,72 +812,515 @@ def solve_lp(routeData, storeLocations, isSaturday=False):
         value of the minimised cost
     optimalRouteData : Pandas DataFrame
         Data frame with all the route info of the chosen routes in the optimal routing plan
+    solveStats : Dict
+        statistics of the solve from SolverConfig.solve, with backend "cache" if the
+        solution was already cached (only returned if stats is true)
     """
-    # this reads demand by weekday, removes the distribution centre and sorts it to be the same order as storeLocations
-    demand = (
-        pd.read_csv("Demand by weekday.csv")
-        .drop(55, axis=0)
-        .sort_values("Store")
-        .reset_index(drop=True)
+    if rates is None:
+        rates = costRates
+
+    # closed stores have no demand, and the routes that visit them are dropped
+    storeDemand = day_demand(storeLocations, isSaturday)
+    routeVisits = None
+    if len(closedStores):
+        closedRows = pd.Index(storeLocations["Store"]).get_indexer(list(closedStores))
+        if (closedRows == -1).any():
+            raise ValueError("closed stores must be in storeLocations")
+        storeDemand = storeDemand.copy()
+        storeDemand[closedRows] = 0
+        routeVisits = column_generation(routeData, storeLocations)
+        keep = np.flatnonzero(
+            np.asarray(routeVisits[closedRows].sum(axis=0)).ravel() == 0
+        )
+        routeData = routeData.take(keep)
+        routeVisits = routeVisits[:, keep]
+
+    if cache is not None:
+        key = solution_key(
+            routeData,
+            storeLocations,
+            storeDemand,
+            isSaturday,
+            maxTrucks,
+            rates,
+        )
+        start = perf_counter()
+        cached = cache.get(key)
+        if cached is not None:
+            status, objective, routes = cached
+            result = (status, objective, routeData.take(routes))
+            if stats:
+                cacheStats = {
+                    "backend": "cache",
+                    "seconds": perf_counter() - start,
+                    "solutionStatus": LpSolution[LpSolutionOptimal],
+                }
+                cacheStats.update({"nodes": None, "gap": 0.0, "iterations": None})
+                result += (cacheStats,)
+            return result
+
+    solution = solve_route_model(
+        routeData,
+        storeLocations,
+        isSaturday,
+        routeVisits,
+        np.flatnonzero(storeDemand != 0),
+        maxTrucks=maxTrucks,
+        rates=rates,
+        solver=solver,
+        writeModel=writeModel,
     )
+    # plans stopped by a time limit or gap are not cached, as they may not be optimal
+    if (
+        cache is not None
+        and solution.status == "Optimal"
+        and solution.stats["solutionStatus"] == LpSolution[LpSolutionOptimal]
+        and solution.stats["gap"] is not None
+        and solution.stats["gap"] < 1e-9
+    ):
+        cache.put(
+            key, solution.status, solution.objective, np.flatnonzero(solution.selected)
+        )
 
-    # create the matrix of which routes visit which locations
-    routeVisits = column_generation(routeData, storeLocations)
-    rows = np.shape(routeVisits)[0]
+    result = (solution.status, solution.objective, solution.routes)
+    if stats:
+        result += (solution.stats,)
+    return result
 
-    # Get index of all route numbers for the df
-    routes = routeData.index
 
-    # Get durations and work out initial costs
-    durations = routeData["Duration"]
-    costs = durations.multiply(0.0625)
+def _solve_job(job):
+    """Solves one scenario of solve_many in its own temporary directory"""
+    routeData, demandColumn, trucks, closedStores, storeLocations, solver, cache = job
+    isSaturday = Route_Generation.dayDemandColumns.index(demandColumn) == 1
 
-    # update costs to include cost of going over 4 hrs and cost of going over demand per route
-    for i in range(len(durations)):
-        if durations[i] > 14400:
-            costs[i] += (durations[i] - 14400) * 50/3600
-    demands = routeData["Demand"]
-    for i in range(len(demands)):
-        if demands[i] > 26:
-            costs[i] += 2000
-    # convert costs to dictionary
-    costs = costs.to_dict()
+    # the solver's model, solution and log files go in a directory only this job uses
+    with tempfile.TemporaryDirectory(prefix="Routes_") as directory:
+        solver = copy.copy(defaultSolver if solver is None else solver)
+        solver.tmpDir = directory
+        return solve_lp(
+            routeData,
+            storeLocations,
+            isSaturday,
+            trucks,
+            cache=cache,
+            solver=solver,
+            stats=True,
+            closedStores=closedStores,
+        )
 
-    # create prob variable object for problem data
-    prob = LpProblem("Routes", LpMinimize)
 
-    # Dictionary containing route variables
-    route_chosen = LpVariable.dicts("route", routes, 0, None, cat="Binary")
+def solve_many(
+    scenarios, workers=None, storeLocations=None, solver=None, cache=solutionCache
+):
+    """Builds and solves several routing models at once in a pool of processes,
+    yielding each result as soon as it is solved.
 
-    # input the obj function into prob using the costs for each route
-    prob += (
-        lpSum([costs[i] * route_chosen[i] for i in routes]),
-        "Objective cost function",
+    Each scenario is solved as by solve_lp, with the solver's files in a temporary
+    directory of its own, so a week of day types and store closures takes about as
+    long as the slowest of them rather than all of them added up. Stages timed in
+    the worker processes are not added to the profiler.
+
+    Parameters:
+    -----------
+    scenarios : List
+        (routeData, demandColumn, maxTrucks, closedStores) of each model, where
+        routeData is a Pandas Dataframe or RoutePool of the routes, demandColumn is
+        "Weekday Demand" or "Saturday Demand" and closedStores lists the names of
+        stores that are closed
+    workers : Int
+        number of processes, defaults to the number of cpus (if 1 the scenarios
+        are solved in this process, in order)
+    storeLocations : Pandas Dataframe
+        Df of every store name, read from WoolworthsDemands.csv if not given
+    solver : SolverConfig
+        settings of the solver, defaultSolver if not given
+    cache : SolutionCache
+        cache of solutions to reuse, or None to always solve the models
+
+    Yields:
+    -------
+    index : Int
+        position of the scenario in scenarios
+    status : String
+        status of the problem, should be optimal
+    objective : Float
+        value of the minimised cost
+    optimalRouteData : Pandas DataFrame or RoutePool
+        the chosen routes in the optimal routing plan
+    solveStats : Dict
+        statistics of the solve from SolverConfig.solve
+    """
+    if storeLocations is None:
+        storeLocations = pd.read_csv("WoolworthsDemands.csv", usecols=[0])
+
+    jobs = []
+    for routeData, demandColumn, trucks, closedStores in scenarios:
+        if demandColumn not in Route_Generation.dayDemandColumns:
+            raise ValueError(
+                "demand columns must be one of "
+                + ", ".join(Route_Generation.dayDemandColumns)
+            )
+        jobs.append(
+            (
+                routeData,
+                demandColumn,
+                trucks,
+                closedStores,
+                storeLocations,
+                solver,
+                cache,
+            )
+        )
+
+    if workers is None:
+        workers = os.cpu_count()
+    workers = min(workers, len(jobs))
+
+    if workers <= 1:
+        for index, job in enumerate(jobs):
+            yield (index,) + _solve_job(job)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(_solve_job, job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            yield (futures[future],) + future.result()
+    finally:
+        # scenarios not yet started are dropped if the caller stops early
+        executor.shutdown(cancel_futures=True)
+
+
+def solve_scenario(
+    base, closedStores=(), addedStores=(), addedRoutes=None, solver=None
+):
+    """Re-solves a solved model with some stores closed or added, starting from its plan.
+
+    Closed stores lose their constraint and every route that visits them is dropped.
+    Added stores get a constraint, and are added to storeLocations if they are new.
+    The base plan (without any dropped routes) is given to the solver as a MIP start,
+    so the scenario only has to repair it rather than solve from scratch.
+
+    Parameters:
+    -----------
+    base : RouteSolution
+        the solved model to start from, from solve_route_model or solve_scenario
+    closedStores : List
+        names of the stores that are closed
+    addedStores : List
+        names of the stores that must also be visited
+    addedRoutes : Pandas DataFrame or RoutePool
+        Df of extra routes, with duration, demand and stops, e.g. routes visiting the added stores
+    solver : SolverConfig
+        settings of the solver, defaultSolver if not given
+
+    Returns:
+    --------
+    solution : RouteSolution
+        the solved scenario
+    """
+    storeLocations = base.storeLocations
+    newStores = [
+        store for store in addedStores if store not in set(storeLocations["Store"])
+    ]
+    if newStores:
+        storeLocations = pd.concat(
+            [storeLocations, pd.DataFrame({"Store": newStores})], ignore_index=True
+        )
+    storeRows = pd.Index(storeLocations["Store"])
+
+    closedRows = storeRows.get_indexer(list(closedStores))
+    if (closedRows == -1).any():
+        raise ValueError("closed stores must be in the base model's storeLocations")
+    addedRows = storeRows.get_indexer(list(addedStores))
+
+    # drops the constraints of closed stores and the routes that visit them
+    coverRows = np.union1d(np.setdiff1d(base.coverRows, closedRows), addedRows)
+    routeVisits = sparse.csc_matrix(base.routeVisits)
+    routeVisits.resize((len(storeLocations), routeVisits.shape[1]))
+    keep = np.asarray(routeVisits[closedRows].sum(axis=0)).ravel() == 0
+    routeData = base.routeData.take(np.flatnonzero(keep))
+    routeVisits = routeVisits[:, keep]
+    warmStart = base.selected[keep].astype(float)
+
+    if addedRoutes is not None:
+        # the added routes are joined in the same form as the base model's routes
+        if isinstance(routeData, Route_Generation.RoutePool):
+            if not isinstance(addedRoutes, Route_Generation.RoutePool):
+                addedRoutes = Route_Generation.RoutePool.from_dataframe(addedRoutes)
+            routeData = Route_Generation.RoutePool.concat([routeData, addedRoutes])
+        else:
+            if isinstance(addedRoutes, Route_Generation.RoutePool):
+                addedRoutes = addedRoutes.to_dataframe()
+            routeData = pd.concat([routeData, addedRoutes], ignore_index=True)
+        routeVisits = sparse.hstack(
+            [routeVisits, column_generation(addedRoutes, storeLocations)], format="csc"
+        )
+        warmStart = np.concatenate((warmStart, np.zeros(len(addedRoutes))))
+    if not isinstance(routeData, Route_Generation.RoutePool):
+        routeData = routeData.reset_index(drop=True)
+
+    return solve_route_model(
+        routeData,
+        storeLocations,
+        base.isSaturday,
+        routeVisits,
+        coverRows,
+        warmStart,
+        solver=solver,
     )
 
-    # constraint: each route only visits node once
-    for i in range(rows):
-        if demand.iloc[i, int(isSaturday)] != 0:
-            prob += lpSum([route_chosen[b] * routeVisits[i][b] for b in routes]) == 1
 
-    # constraint: Trucks
-    prob += lpSum(route_chosen[i] for i in routes) <= 60
+def price_routes(
+    durations, duals, truckDual, loads, maxStops=4, beamWidth=2000, rates=None
+):
+    """Finds routes with negative reduced cost given the duals of the LP relaxation.
 
-    ##SOLVING ROUTINES##
-    prob.writeLP("Routes.lp")
-    prob.solve()
+    Routes are grown from the depot one store at a time, all at once as arrays. Only
+    stores with a positive dual can lower a route's reduced cost, so only they are
+    added. After each store the beamWidth routes with the lowest reduced cost
+    (if they went straight back to the depot) are kept to be grown further, so the
+    search is exact only while fewer routes than beamWidth are feasible.
+
+    Parameters:
+    -----------
+    durations : Route_Generation.DurationMatrix
+        matrix of travel times between each location
+    duals : 1d Array
+        dual price of visiting each location in the duration matrix
+    truckDual : Float
+        dual price of the trucks constraint
+    loads : 1d Array
+        demand of each location in the duration matrix
+    maxStops : Int
+        most stores visited on a route
+    beamWidth : Int
+        number of partial routes kept after each stop, if None all are kept
+    rates : Dict
+        rates used to cost the routes and the number of pallets that fit on a
+        truck, costRates if not given
+
+    Returns:
+    --------
+    newRoutes : Pandas DataFrame
+        routes with negative reduced cost, with duration, demand and stops
+    reducedCosts : 1d Array
+        reduced cost of each new route
+    """
+    if rates is None:
+        rates = costRates
+    capacity = rates["truckCapacity"]
+    values = durations.values
+    depot = durations.depot
+    candidates = np.flatnonzero(duals > 1e-9)
+
+    # partial routes start empty at the depot
+    stops = np.empty((1, 0), dtype=np.intp)
+    travel = np.zeros(1)
+    load = np.zeros(1)
+    dualSum = np.zeros(1)
+    last = np.array([depot])
+
+    found = []
+    for k in range(maxStops):
+        # every partial route extended by every candidate store it has not visited yet
+        newTravel = travel[:, None] + values[last][:, candidates]
+        newLoad = load[:, None] + loads[candidates]
+        newDual = dualSum[:, None] + duals[candidates]
+        visited = (stops[:, :, None] == candidates[None, None, :]).any(axis=1)
+        valid = ~visited & (newLoad <= capacity)
+
+        # reduced cost of each extension if it then went back to the depot
+        duration = (
+            newTravel
+            + values[candidates, depot]
+            + newLoad * Route_Generation.unloadTime
+        )
+        costs = duration_costs(duration, rates)
+        reducedCosts = np.where(valid, costs - newDual - truckDual, np.inf)
 
-    # get and store the route numbers that were chosen by the solver
-    optimalRoutes = []
-    for v in prob.variables():
-        if v.varValue == 1:
-            optimalRoutes.append(int(str(v.name).replace("route_", "")))
+        # keeps the best extensions, dropping repeats of the same stores ending at the same store
+        routeNumbers, storeNumbers = np.nonzero(np.isfinite(reducedCosts))
+        order = np.argsort(reducedCosts[routeNumbers, storeNumbers], kind="stable")
+        routeNumbers, storeNumbers = routeNumbers[order], storeNumbers[order]
+        newStops = np.column_stack((stops[routeNumbers], candidates[storeNumbers]))
+        keys = np.column_stack((np.sort(newStops[:, :-1], axis=1), newStops[:, -1]))
+        unique = np.sort(np.unique(keys, axis=0, return_index=True)[1])
+        routeNumbers, storeNumbers, newStops = (
+            routeNumbers[unique],
+            storeNumbers[unique],
+            newStops[unique],
+        )
 
-    # Use the route numbers to pull the correponding route data and append it to an empty df to display.
-    optimalRouteData = pd.DataFrame(columns=routeData.columns)
-    optimalRouteData = routeData.loc[np.r_[optimalRoutes]]
+        extended = reducedCosts[routeNumbers, storeNumbers]
+        negative = extended < -1e-6
+        padded = np.full((negative.sum(), maxStops), -1, dtype=np.intp)
+        padded[:, : k + 1] = newStops[negative]
+        found.append(
+            (
+                padded,
+                duration[routeNumbers, storeNumbers][negative],
+                newLoad[routeNumbers, storeNumbers][negative],
+                extended[negative],
+            )
+        )
 
-    return LpStatus[prob.status], value(prob.objective), optimalRouteData
+        if beamWidth is not None:
+            routeNumbers, storeNumbers, newStops = (
+                routeNumbers[:beamWidth],
+                storeNumbers[:beamWidth],
+                newStops[:beamWidth],
+            )
+        stops = newStops
+        travel = newTravel[routeNumbers, storeNumbers]
+        load = newLoad[routeNumbers, storeNumbers]
+        dualSum = newDual[routeNumbers, storeNumbers]
+        last = stops[:, -1]
+        if len(stops) == 0:
+            break
+
+    newStops = np.vstack([f[0] for f in found])
+    newRoutes = Route_Generation.routes_dataframe(
+        durations, np.concatenate([f[1] for f in found]), newStops
+    )
+    newRoutes.insert(
+        1, "Demand", np.concatenate([f[2] for f in found]).astype(np.int64)
+    )
+
+    return newRoutes, np.concatenate([f[3] for f in found])
+
+
+def solve_column_generation(
+    storeLocations,
+    isSaturday=False,
+    initialRoutes=None,
+    maxStops=4,
+    routesPerIteration=100,
+    maxIterations=200,
+    beamWidth=2000,
+    rates=None,
+    solver=None,
+):
+    """Solves the routing problem by delayed column generation rather than from a
+    precomputed route pool.
+
+    The LP relaxation of the model in solve_lp is solved over a small pool of routes,
+    the dual prices of the store constraints are used to price new routes over the
+    duration matrix (see price_routes), and the routes with the most negative reduced
+    cost are added until none are found. The mixed integer programme is then solved
+    over the routes that were generated.
+
+    Parameters:
+    -----------
+    storeLocations : Pandas Dataframe
+        Df of every store name
+    isSaturday : Boolean
+        true if the deliveries are for a saturday
+    initialRoutes : Pandas Dataframe
+        Df of routes to start from, by default a nearest neighbour route of each
+        length from every store
+    maxStops : Int
+        most stores visited on a route
+    routesPerIteration : Int
+        most routes added to the pool after each LP solve
+    maxIterations : Int
+        most LP solves before the integer programme is solved
+    beamWidth : Int
+        number of partial routes kept at each stop while pricing
+    rates : Dict
+        rates used to cost the routes, both in the LP and when pricing new routes,
+        costRates if not given
+    solver : SolverConfig
+        settings of the solver for the LP relaxations and the integer programme,
+        defaultSolver if not given
+
+    Returns:
+    --------
+    LpStatus[prob.status] : Variable
+        status of the integer programme, should be optimal
+    value(prob.objective) : Int
+        value of the minimised cost
+    optimalRouteData : Pandas DataFrame
+        Data frame with all the route info of the chosen routes in the optimal routing plan
+    routeData : Pandas DataFrame
+        Data frame of every route generated
+    """
+    durations, coordinates, demand = Route_Generation.load_data()
+    loads = Route_Generation.store_demand(durations, demand, isSaturday)
+    openStores = Route_Generation.open_store_mask(durations, demand, isSaturday)
+    coverRows = covered_stores(storeLocations, isSaturday)
+    storeIndex = durations.lookup(storeLocations["Store"])
+
+    # start from nearest neighbour routes from every store that needs a delivery
+    if initialRoutes is None:
+        starts = [durations.stores[i] for i in np.flatnonzero(openStores)]
+        initialRoutes = pd.concat(
+            [
+                Route_Generation.nearest_neighbour_route_generation(
+                    durations, starts, k, True, openStores
+                )
+                for k in range(1, maxStops + 1)
+            ],
+            ignore_index=True,
+        )
+        initialRoutes = Route_Generation.demand_calculator(
+            initialRoutes, demand, isSaturday
+        )
+        initialRoutes = Route_Generation.filter_routes(initialRoutes)
+    routeData = initialRoutes.reset_index(drop=True)
+
+    # an artificial visit costs more than any set of routes, so is only used if the pool cannot cover a store
+    artificialCost = 1000 * route_costs(routeData, rates).max()
+    if solver is None:
+        solver = defaultSolver
+
+    for iteration in range(maxIterations):
+        prob, routeVars, coverConstraints = build_model(
+            route_costs(routeData, rates),
+            column_generation(routeData, storeLocations),
+            coverRows,
+            relax=True,
+            artificialCost=artificialCost,
+        )
+        solver.solve(prob)
+
+        # dual prices of visiting each store, in duration matrix order
+        rowDuals, truckDual = model_results(
+            prob, routeVars, coverConstraints, len(storeLocations)
+        )[1:3]
+        duals = np.zeros(len(durations.stores))
+        duals[storeIndex[coverRows]] = rowDuals[coverRows]
+
+        newRoutes, reducedCosts = price_routes(
+            durations, duals, truckDual, loads, maxStops, beamWidth, rates
+        )
+
+        # adds the most negative routes which are not already in the pool
+        stops = [
+            column
+            for column in routeData.columns
+            if column in Route_Generation.stopColumns
+        ]
+        known = set(routeData[stops].itertuples(index=False, name=None))
+        newRoutes = newRoutes.reindex(columns=routeData.columns)
+        isNew = [
+            route not in known
+            for route in newRoutes[stops].itertuples(index=False, name=None)
+        ]
+        newRoutes = newRoutes[isNew].iloc[
+            np.argsort(reducedCosts[isNew], kind="stable")
+        ]
+        if len(newRoutes) == 0:
+            break
+        routeData = pd.concat(
+            [routeData, newRoutes.head(routesPerIteration)], ignore_index=True
+        )
+
+    status, minimisedCost, optimalRouteData = solve_lp(
+        routeData, storeLocations, isSaturday, rates=rates, solver=solver
+    )
+
+    return status, minimisedCost, optimalRouteData, routeData
 
 
 if __name__ == "__main__":
@@ -182,7 +1329,9 @@ if __name__ == "__main__":
 
     # UNCOMMENT THE ONE YOU WANT TO SOLVE
     # status, minimisedCost, routes = solve_lp(Weekday_Routes, storeLocations)
-    status, minimisedCost, routes = solve_lp(Weekend_Routes, storeLocations, True)
+    status, minimisedCost, routes = solve_lp(
+        Weekend_Routes, storeLocations, True, cache=None, writeModel="Routes.lp"
+    )
 
     print("Status: ", status)
     print("Minimal Cost: ", minimisedCost)
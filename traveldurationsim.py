@@ -1,20 +1,111 @@
 import numpy as np
 from pulp import *
 from Woolworths_LP import *
-import statistics as stats
+import Route_Generation
 import matplotlib.pyplot as plt
 import scipy.stats as st
-def travelsimulation(routesWeek, routesSat):
+from Simulation_Stats import run_to_precision
+
+# our estimated random distribution of the travel time factor: lognormal
+mu = 0.03
+sigma = 0.07
+
+def travel_costs(travelDuration, unloadDuration, factors, chunkSize=100000, rates=None):
     """
     
-    Simulates the travel times 1000 times to show the range of costs
+    Calculates the cost of a set of routes for each random travel time factor
 
     Parameters:
     ----------
-    routesWeek: Pandas Dataframe
+    travelDuration: array
+                Time spent travelling on each route (seconds)
+    unloadDuration: array
+                Time spent unloading on each route (seconds), which is not random
+    factors: array
+                Random factor multiplying the travel time in each simulation
+    chunkSize: int
+                Number of simulations costed at once, to bound memory use
+    rates: dict
+                Rates the time is costed with, as in the LP (Woolworths_LP.costRates if not given)
+    
+    Returns:
+    ----------
+    costs: array
+                Total cost of the routes in each simulation
+    
+    """
+    costs = np.empty(len(factors))
+
+    for start in range(0, len(factors), chunkSize):
+        chunk = factors[start:start + chunkSize]
+
+        # (simulations x routes) durations, with the random factor applied to travel only
+        durations = np.outer(chunk, travelDuration) + unloadDuration
+
+        # costed the same way as the routes in the LP
+        costs[start:start + chunkSize] = duration_costs(durations, rates).sum(axis=1)
+
+    return costs
+
+
+def adaptive_travelsimulation(routes, tolerance=None, relTolerance=None, confidence=0.95,
+                              batchSize=1000, maxSimulations=1000000, rng=None):
+    """
+    
+    Simulates the travel times in batches until the confidence interval of the mean
+    cost is narrower than a given tolerance
+
+    Parameters:
+    ----------
+    routes: Pandas Dataframe or RoutePool
+                Contains the routes for the day: demand, total duration
+    tolerance: float
+                Largest half-width of the confidence interval in dollars
+    relTolerance: float
+                Largest half-width of the confidence interval as a fraction of the mean cost
+    confidence: float
+                Confidence level of the interval
+    batchSize: int
+                Number of simulations run between checks of the interval
+    maxSimulations: int
+                Most simulations run if the tolerance is not reached
+    rng: numpy.random.Generator
+                Random number generator to draw from, seeded with 100 if not given
+    
+    Returns:
+    ----------
+    accumulator: CostAccumulator
+                Summary of the costs, where accumulator.count is the number of simulations run
+    converged: Boolean
+                Boolean equalling true if the tolerance was reached
+    
+    """
+    # separate the loading time as it is irrelevant to the travel durations
+    duration, unload = Route_Generation.travel_and_unload(routes)
+
+    if rng is None:
+        rng = np.random.default_rng(100)
+
+    return run_to_precision(
+        lambda n: travel_costs(duration, unload, rng.lognormal(mu, sigma, n)),
+        tolerance, relTolerance, confidence, batchSize, maxSimulations)
+
+
+def travelsimulation(routesWeek, routesSat, simulations=1000, rng=None):
+    """
+    
+    Simulates the travel times to show the range of costs
+
+    Parameters:
+    ----------
+    routesWeek: Pandas Dataframe or RoutePool
                 Contains the routes for weekdays: demand, total duration
-    routesSat: Pandas Dataframe
+    routesSat: Pandas Dataframe or RoutePool
                 Contains the routes for Saturdays: demand, total duration
+    simulations: int
+                Number of times to simulate the travel times
+    rng: numpy.random.Generator
+                Random number generator to draw from, seeded with 100 if not given
     
     Returns:
     ----------
@@ -24,74 +115,22 @@ def travelsimulation(routesWeek, routesSat):
                 In form of (minimum, mean, maximum) for Saturday costs
     
     """
-    # obtain the optimal durations found for both weekdays and saturdays
-    weekDuration = routesWeek.loc[:,'Duration']
-    satDuration = routesSat.loc[:,'Duration']
-
-    # convert to an array to calculate
-    weekDuration = weekDuration.values
-    satDuration = satDuration.values
-
-    # obtain the demands for both weekdays and saturdays
-    weekDemand = routesWeek.loc[:,'Demand']
-    satDemand = routesSat.loc[:,'Demand']
-
-    # convert to an array to calculate
-    weekDemand = weekDemand.values
-    satDemand = satDemand.values
-
-    # subtract the loading time as it is irrelevant to the travel durations
-    weekDuration = weekDuration-(7.5*60*weekDemand)
-    satDuration = satDuration-(7.5*60*satDemand)
-
-    # initialise
-    weekCost = [0] * 1000
-    satCost = [0] * 1000
-    simulations = [0] * 1000
-
-    # our estimated random distribution: lognormal
-    mu = 0.03 
-    sigma = 0.07
-    np.random.seed(100)      # seed for random distribution
-    random = np.random.lognormal(mu, sigma, 1000)
-
-    for j in range(len(simulations)):
-
-        # multiply by the random factor generated from the random lognormal distribution
-
-        weekRandom = weekDuration * random[j]
-        satRandom = satDuration * random[j]
-
-        # add back the loading times
-        weekRandom = weekRandom + (7.5*60*weekDemand)
-        satRandom = satRandom + (7.5*60*satDemand)
-
-        # convert to hours
-        weekRandom = weekRandom/(60*60)
-        satRandom = satRandom/(60*60)
-
-        # convert to costs
-        for i in range(len(weekRandom)):
-            if weekRandom[i] < 4:
-                weekRandom[i] = weekRandom[i] * 225
-            else:
-                overtime = weekRandom[i]-4      # overtime costs
-                weekRandom[i] = (weekRandom[i] * 225) + (overtime * 275)
-
-        for i in range(len(satRandom)):
-            if satRandom[i] < 4:
-                satRandom[i] = satRandom[i] * 225
-            else:
-                overtime = satRandom[i]-4       # overtime costs
-                satRandom[i] = (satRandom[i] * 225) + (overtime * 275)
-
-        # sum of costs of routes for current simulation 
-        weekCost[j] = sum(weekRandom)
-        satCost[j] = sum(satRandom)
-
-    # obtain the minimum, mean and the maximum costs after 1000 simulations
-    weekRange = [(min(weekCost),stats.mean(weekCost),max(weekCost))]
-    satRange = [(min(satCost),stats.mean(satCost),max(satCost))]
+    # separate the loading time from the optimal durations found for both weekdays and
+    # saturdays, as it is irrelevant to the travel durations
+    weekDuration, weekUnload = Route_Generation.travel_and_unload(routesWeek)
+    satDuration, satUnload = Route_Generation.travel_and_unload(routesSat)
+
+    if rng is None:
+        rng = np.random.default_rng(100)      # seed for random distribution
+    random = rng.lognormal(mu, sigma, simulations)
+
+    # costs of every simulation at once
+    weekCost = travel_costs(weekDuration, weekUnload, random)
+    satCost = travel_costs(satDuration, satUnload, random)
+
+    # obtain the minimum, mean and the maximum costs after all simulations
+    weekRange = [(weekCost.min(), weekCost.mean(), weekCost.max())]
+    satRange = [(satCost.min(), satCost.mean(), satCost.max())]
     
 
     # Displays histograms of the logistic plan costs
@@ -102,8 +141,8 @@ def travelsimulation(routesWeek, routesSat):
 
 
     # Confidence interval calculator 
-    weekdayInterval = st.norm.interval(alpha = 0.95, loc = np.mean(weekCost), scale = st.sem(weekCost))
-    saturdayInterval = st.norm.interval(alpha = 0.95, loc = np.mean(satCost), scale = st.sem(satCost))
+    weekdayInterval = st.norm.interval(0.95, loc = np.mean(weekCost), scale = st.sem(weekCost))
+    saturdayInterval = st.norm.interval(0.95, loc = np.mean(satCost), scale = st.sem(satCost))
     print("95% Confidence Interval for weekdays", weekdayInterval)
     print("95% Confidence Interval for saturdays", saturdayInterval)
     
@@ -114,9 +153,13 @@ if __name__ == "__main__":
     # load data
     Weekday_Routes, Weekend_Routes, storeLocations = load_data()
 
-    # find the optimal routes using LP
-    routesWeek = solve_lp(Weekday_Routes, storeLocations)[2]
-    routesSat = solve_lp(Weekend_Routes, storeLocations, True)[2]
+    # find the optimal weekday and saturday routes at the same time using LP
+    scenarios = [(Weekday_Routes, "Weekday Demand", maxTrucks, ()),
+                 (Weekend_Routes, "Saturday Demand", maxTrucks, ())]
+    solved = {}
+    for i, status, minCost, routes, stats in solve_many(scenarios, storeLocations=storeLocations):
+        solved[i] = routes
+    routesWeek, routesSat = solved[0], solved[1]
 
     # enter routes to travel simulator
     weekRange, satRange = travelsimulation(routesWeek, routesSat)
@@ -125,5 +168,10 @@ if __name__ == "__main__":
     print("Costs for travel durations weekdays (min,mean,max):", weekRange)
     print("Costs for travel durations saturdays (min,mean,max):", satRange)
 
+    # simulate until the mean weekday cost is known to within 0.1%
+    accumulator, converged = adaptive_travelsimulation(routesWeek, relTolerance=0.001)
+    print("95% Confidence Interval for weekdays", accumulator.interval(),
+          "after", accumulator.count, "simulations")
+
 
 